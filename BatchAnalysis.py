@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+# -*-coding:utf-8 -*-
+
+# Reference: **********************************************
+# @Project   : code
+# @File    : BatchAnalysis.py
+# @Time    : 2026/10/18 10:05
+# @License   : LGPL
+# @Author   : Dorad
+# @Email    : cug.xia@gmail.com
+# @Blog      : https://blog.cuger.cn
+
+'''
+Batch analysis of project files without GUI.
+
+Usage:
+    python BatchAnalysis.py project1.pro project2.pro ... -o ./results -j 8 --method otsu
+
+For each project the label image is saved as <name>-label.npz and the region table as <name>-regions.csv.
+The .npz keeps the runs of the label image (shape, values, lengths), it's decoded by ImageAnalysis.decodeLabelRuns.
+With --memory-budget the image is analysed tile by tile, and the label image is written to <name>-label.npy
+through np.memmap, so very large images could be processed with bounded memory.
+'''
+
+import argparse
+import csv
+import os
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+from skimage import io
+
+from ImageAnalysis import analyseImage, tiledAnalyseImage, encodeLabelRuns, regionStatistics, regionChunkRows
+from ProjectFile import loadProject
+
+
+def readProject(projectPath):
+    '''
+    read ROIs and crop polygon from project file.
+    Args:
+        projectPath: path of project file
+
+    Returns: dict, base_image, crop_polygon, polygons, real_scale
+
+    '''
+    # the label image of the project is not needed
+    project = loadProject(projectPath, arrays=False)
+    imagePath = project['base_image']
+    if not os.path.isabs(imagePath) and not os.path.exists(imagePath):
+        imagePath = os.path.join(os.path.dirname(os.path.abspath(projectPath)), imagePath)
+    cropPolygon = np.array(project['crop_polygon'], dtype=float).reshape(-1, 2) if project['crop_polygon'] else None
+    polygons = [np.array(polygon['geo'], dtype=float).reshape(-1, 2) for polygon in project['polygon'] or []]
+    return {
+        'base_image': imagePath,
+        'crop_polygon': cropPolygon,
+        'polygons': polygons,
+        'real_scale': project.get('real_scale', None)
+    }
+
+
+def loadImage(imagePath, mmap=False):
+    '''
+    load image, the .npy and uncompressed .tif images are memory mapped if mmap is True.
+    Args:
+        imagePath: path of image
+        mmap: bool, memory map the image if possible
+
+    Returns: np.array
+
+    '''
+    ext = os.path.splitext(imagePath)[1].lower()
+    if mmap and ext == '.npy':
+        return np.load(imagePath, mmap_mode='r')
+    if mmap and ext in ['.tif', '.tiff']:
+        import tifffile
+        try:
+            return tifffile.memmap(imagePath, mode='r')
+        except ValueError:
+            # compressed tiff could not be memory mapped
+            pass
+    return io.imread(imagePath)
+
+
+def saveRegionTable(filePath, stats, realScale=None):
+    '''
+    save the region properties as csv, the same columns as the result table.
+    Args:
+        filePath: path of csv file
+        stats: region statistics from RegionPropertyStore.statistics
+        realScale: mm per pixel
+
+    Returns:
+
+    '''
+    scale = realScale if realScale else 0
+    with open(filePath, 'w') as stream:
+        writer = csv.writer(stream, lineterminator='\n')
+        writer.writerow(['Label', 'Center X(px)', 'Center Y(px)', 'Area(mm^2)', 'Perimeter(mm)', 'Area(px^2)',
+                         'Perimeter(px)'])
+        for i in range(len(stats['label'])):
+            writer.writerow([
+                stats['label'][i],
+                '%.2f' % stats['centroid_row'][i],
+                '%.2f' % stats['centroid_col'][i],
+                '%.2f' % (stats['area'][i] * scale * scale),
+                '%.2f' % (stats['perimeter'][i] * scale),
+                '%.2f' % stats['area'][i],
+                '%.2f' % stats['perimeter'][i]
+            ])
+        writer.writerow(['Total', '', '',
+                         '%.2f' % (np.sum(stats['area']) * scale * scale),
+                         '%.2f' % (np.sum(stats['perimeter']) * scale),
+                         '%.2f' % np.sum(stats['area']),
+                         '%.2f' % np.sum(stats['perimeter'])])
+
+
+def analyseProject(args):
+    '''
+    analyse one project, run in the worker process.
+    Args:
+        args: (projectPath, outputDir, method, memoryBudget)
+
+    Returns: (projectPath, number of regions, error message)
+
+    '''
+    projectPath, outputDir, method, memoryBudget = args
+    try:
+        project = readProject(projectPath)
+        name = os.path.splitext(os.path.basename(projectPath))[0]
+        image = loadImage(project['base_image'], mmap=memoryBudget is not None)
+        if memoryBudget is None:
+            labelMask = analyseImage(image, project['polygons'], project['crop_polygon'], method=method)
+            values, lengths = encodeLabelRuns(labelMask)
+            np.savez_compressed(os.path.join(outputDir, '%s-label.npz' % name), shape=labelMask.shape, values=values,
+                                lengths=lengths)
+        else:
+            labelMask = np.lib.format.open_memmap(os.path.join(outputDir, '%s-label.npy' % name), mode='w+',
+                                                  dtype=np.int32, shape=image.shape[:2])
+            tiledAnalyseImage(image, project['polygons'], project['crop_polygon'], method=method,
+                              memoryBudget=memoryBudget, out=labelMask)
+            labelMask.flush()
+        if memoryBudget is None:
+            stats = regionStatistics(labelMask)
+        else:
+            # the label image is reduced band by band, in the same budget as the analysis
+            stats = regionStatistics(labelMask, chunkRows=regionChunkRows(labelMask.shape[1], memoryBudget))
+        saveRegionTable(os.path.join(outputDir, '%s-regions.csv' % name), stats, project['real_scale'])
+        return projectPath, len(stats['label']), None
+    except Exception as e:
+        return projectPath, 0, str(e)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batch analysis of the shear damage zones without GUI.')
+    parser.add_argument('projects', nargs='+', help='project files (*.pro)')
+    parser.add_argument('-o', '--output', default='.', help='directory for the results')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--method', choices=['otsu', 'riss'], default='otsu', help='analysis method')
+    parser.add_argument('--memory-budget', type=float, default=None,
+                        help='analyse the image tile by tile, memory (MB) for the temporary arrays of each worker')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output, exist_ok=True)
+    memoryBudget = int(args.memory_budget * 2 ** 20) if args.memory_budget else None
+    tasks = [(projectPath, args.output, args.method, memoryBudget) for projectPath in args.projects]
+    failed = 0
+    with Pool(processes=max(1, min(args.workers, len(tasks)))) as pool:
+        for i, (projectPath, count, error) in enumerate(pool.imap_unordered(analyseProject, tasks)):
+            if error:
+                failed += 1
+                print('[%d/%d] %s: failed, %s' % (i + 1, len(tasks), projectPath, error))
+            else:
+                print('[%d/%d] %s: %d regions' % (i + 1, len(tasks), projectPath, count))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,6 +13,65 @@ import sys
 import numpy as np
 
 
+USHRT_MAX = 65535
+
+
+def hsvColors(angle, radiusPercentage):
+    '''
+    vectorized ColorCircle.getColorByAngleAndRP, hue from angle and value from radius percentage,
+    the rgb values are converted in the same way as QColor.setHsvF.
+    Args:
+        angle: np.array, angle in radian, [0, 2pi]
+        radiusPercentage: np.array, [0, 1], the color is transparent white if it's greater than 1
+
+    Returns: np.array, (..., 4), uint8, RGBA
+
+    '''
+    angle = np.asarray(angle, dtype=float)
+    radiusPercentage = np.asarray(radiusPercentage, dtype=float)
+    # QColor keeps hue in 1/100 degree and value in 16 bits
+    hue = np.floor(angle / (2. * np.pi) * 36000 + 0.5)
+    value = np.floor(np.clip(radiusPercentage, 0., 1.) * USHRT_MAX + 0.5)
+    # the same steps as QColor.toRgb, saturation is 1.0
+    h = np.where(hue == 36000, 0., hue / 6000.)
+    v = value / USHRT_MAX
+    i = h.astype(int)
+    f = h - i
+    p = np.zeros(h.shape)
+    q = v * (1. - f)
+    t = v * (1. - (1. - f))
+    r = np.choose(i % 6, [v, q, p, p, t, v])
+    g = np.choose(i % 6, [t, v, v, q, p, p])
+    b = np.choose(i % 6, [p, p, t, v, v, q])
+    rgb = np.floor(np.stack([r, g, b], axis=-1) * USHRT_MAX + 0.5).astype(np.int64)
+    # 16 bits to 8 bits
+    rgb = (rgb + 128) // 257
+    rgba = np.concatenate([rgb, np.full(h.shape + (1,), 255)], axis=-1).astype(np.uint8)
+    rgba[radiusPercentage > 1.0] = [255, 255, 255, 0]
+    return rgba
+
+
+def colorCircleImage(radius, devicePixelRatio=1.0):
+    '''
+    legend of ColorCircle, the same colors as hsvColors, generated at once for all the pixels.
+    Args:
+        radius: float, radius of the circle in device independent pixels
+        devicePixelRatio: float, the image has radius * 2 * devicePixelRatio pixels on each side
+
+    Returns: QImage, ARGB32, with devicePixelRatio
+
+    '''
+    from qimage2ndarray import array2qimage
+    size = int(np.ceil(radius * 2 * devicePixelRatio))
+    # device independent coordinates of the pixels
+    pos = np.arange(size) / devicePixelRatio
+    i, j = np.meshgrid(pos - radius, pos - radius)
+    angle = np.arctan2(i, j) + np.pi
+    image = array2qimage(hsvColors(angle, np.sqrt(i * i + j * j) / radius))
+    image.setDevicePixelRatio(devicePixelRatio)
+    return image
+
+
 class ColorCircle(QWidget):
     def __init__(self, radius=100.0):
         QWidget.__init__(self)
@@ -20,17 +79,20 @@ class ColorCircle(QWidget):
         self.setFixedSize(radius * 2, radius * 2)
         self.setWindowFlags(Qt.FramelessWindowHint)
         self.setAttribute(Qt.WA_TranslucentBackground)
+        # legend image with (radius, devicePixelRatio), generated again only if they're changed
+        self.legendCache = None
 
     def paintEvent(self, ev):
         QWidget.paintEvent(self, ev)
         p = QPainter(self)
-        for i in range(self.width()):
-            for j in range(self.height()):
-                angle = np.arctan2(i - self.radius, j - self.radius) + np.pi
-                r = np.sqrt(np.power(i - self.radius, 2) + np.power(j - self.radius, 2))
-                color = self.getColorByAngleAndRP(angle, r / self.radius)
-                p.setPen(color)
-                p.drawPoint(i, j)
+        p.drawImage(0, 0, self.legend())
+        p.end()
+
+    def legend(self):
+        key = (self.radius, self.devicePixelRatioF())
+        if self.legendCache is None or self.legendCache[0] != key:
+            self.legendCache = (key, colorCircleImage(*key))
+        return self.legendCache[1]
 
     def getColorByAngleAndRP(self, angle, radiusPercentage):
         color = QColor(255, 255, 255, 0)
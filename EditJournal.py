@@ -0,0 +1,282 @@
+#!/usr/bin/python3
+# -*-coding:utf-8 -*-
+
+# Reference: **********************************************
+# @Project   : code
+# @File    : EditJournal.py
+# @Time    : 2026/10/18 23:30
+# @License   : LGPL
+# @Author   : Dorad
+# @Email    : cug.xia@gmail.com
+# @Blog      : https://blog.cuger.cn
+
+'''
+edit journal, an append-only file beside the project (or the image) with the edits after the project file was saved,
+such as the polygons added or deleted, the crop polygon, the real scale and the label edits. The label edits are
+saved as the runs of the changed window, so a record is about the length of the region borders in it.
+The records are written in background, and the journal is reset when the project is saved, so the project file is
+the snapshot and the journal is replayed on it to recover the edits after a crash.
+
+Each record is framed as (payload size, crc32) and the payload is a JSON header with the arrays in .npy format.
+A record torn by a crash is found by its size or crc32, and the journal is replayed up to the record before it.
+'''
+
+import io
+import json
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ImageAnalysis import compactLabels, encodeLabelRuns, decodeLabelRuns, labelDtype
+
+JOURNAL_FORMAT = 'SDZM-Tool journal'
+JOURNAL_VERSION = 1
+JOURNAL_MAGIC = b'SDZM-Tool journal\n'
+JOURNAL_SUFFIX = '.journal'
+# (payload size, crc32) of record
+RECORD_FRAME = struct.Struct('<II')
+# actions of the manifest of project, and of the label image
+PROJECT_ACTIONS = ('set', 'polygon_add', 'polygon_delete')
+LABEL_ACTIONS = ('labels',)
+
+
+def journalPath(path):
+    '''
+    path of the edit journal beside the project file (or the image of a new project).
+    '''
+    return path + JOURNAL_SUFFIX
+
+
+class EditJournal(object):
+    '''
+    writer of the edit journal. The records are kept in memory and written in a background thread by flush,
+    the file is synced after each write, so the edits before the last flush are kept after a crash.
+    '''
+
+    def __init__(self, journalPath, begin: dict, encoder=None, resume=None):
+        '''
+        Args:
+            journalPath: path of the journal
+            begin: dict, the project the edits are based on, such as revision and base_image
+            encoder: json.JSONEncoder class for the values of records, such as Qt objects
+            resume: int, end of the valid records of the exist journal (from readJournal), they're kept and the
+                new records are appended after them. The journal is created again if it's None.
+        '''
+        self.journalPath = journalPath
+        self.encoder = encoder
+        self.pending = []
+        # records after begin, the journal without edits is removed when it's closed
+        self.edits = 0
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.future = None
+        if resume is None:
+            self.file = open(journalPath, 'wb')
+            self.file.write(JOURNAL_MAGIC)
+            begin = dict(begin, format=JOURNAL_FORMAT, version=JOURNAL_VERSION)
+            self.pending.append((json.dumps(dict(begin, action='begin'), cls=encoder), {}))
+            self.flush()
+        else:
+            self.file = open(journalPath, 'r+b')
+            # the torn record is dropped
+            self.file.truncate(resume)
+            self.file.seek(resume)
+            self.edits = 1
+
+    def record(self, action, data: dict = None, arrays: dict = None):
+        '''
+        append a record, it's written by the next flush.
+        Args:
+            action: str, such as 'set', 'polygon_add', 'polygon_delete' and 'labels'
+            data: dict, values of the record, encoded with the encoder now
+            arrays: dict, name -> np.array, they shouldn't be changed until they're written
+
+        Returns:
+
+        '''
+        arrays = arrays or {}
+        # the label window is saved as its runs
+        names = [name for key in arrays for name in (['values', 'lengths'] if key == 'window' else [key])]
+        header = dict(data or {}, action=action, arrays=names)
+        self.pending.append((json.dumps(header, cls=self.encoder), arrays))
+        self.edits += 1
+
+    def recordLabels(self, labelMask: np.array, window=None, lut: np.array = None):
+        '''
+        append the label edit, only the window of the label mask is copied now, the runs of it are encoded in
+        background. It's replayed as: the lut is applied to the whole label mask, then the window is replaced.
+        Args:
+            labelMask: np.array, label mask after the edit
+            window: (r0, r1, c0, c1), the changed window, it's clipped to the label mask. None for the whole mask
+            lut: np.array, lookup table the whole label mask is relabeled with, None if it's not relabeled
+
+        Returns:
+
+        '''
+        h, w = labelMask.shape
+        if window is None:
+            window = (0, h, 0, w)
+        r0, r1, c0, c1 = max(0, window[0]), min(h, window[1]), max(0, window[2]), min(w, window[3])
+        r1, c1 = max(r0, r1), max(c0, c1)
+        arrays = {'window': labelMask[r0:r1, c0:c1].copy()}
+        if lut is not None:
+            arrays['lut'] = compactLabels(np.asarray(lut))
+        self.record('labels', {'shape': [h, w], 'window': [r0, r1, c0, c1]}, arrays)
+
+    def flush(self, wait=False):
+        '''
+        write the records in background, the records are written in order.
+        Args:
+            wait: bool, wait until the records are written
+
+        Returns:
+
+        '''
+        if self.pending:
+            records, self.pending = self.pending, []
+            self.future = self.executor.submit(self.__write, records)
+        if wait and self.future is not None:
+            self.future.result()
+
+    def close(self, remove=False):
+        '''
+        write the records and close the journal.
+        Args:
+            remove: bool, remove the journal, such as the edits are saved in the project. The journal without
+                edits is always removed.
+
+        Returns:
+
+        '''
+        if self.file is None:
+            return
+        self.flush(wait=True)
+        self.executor.shutdown(wait=True)
+        self.file.close()
+        self.file = None
+        if remove or not self.edits:
+            try:
+                os.remove(self.journalPath)
+            except OSError as e:
+                print('Failed to remove edit journal: %s' % e)
+
+    def __write(self, records):
+        try:
+            for header, arrays in records:
+                self.file.write(EditJournal.__frame(header, arrays))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except Exception as e:
+            print('Failed to write edit journal: %s' % e)
+
+    @staticmethod
+    def __frame(header, arrays):
+        payload = io.BytesIO()
+        header = header.encode('utf-8')
+        payload.write(struct.pack('<I', len(header)))
+        payload.write(header)
+        for key, array in arrays.items():
+            for array in (encodeLabelRuns(array) if key == 'window' else [array]):
+                np.lib.format.write_array(payload, np.ascontiguousarray(array), allow_pickle=False)
+        payload = payload.getvalue()
+        return RECORD_FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def readJournal(journalPath):
+    '''
+    read the records of the journal, the records after a torn one are dropped.
+    Args:
+        journalPath: path of the journal
+
+    Returns: (records, end), list of (header, arrays) with the begin record at first, and the end of valid records
+
+    '''
+    records = []
+    with open(journalPath, 'rb') as f:
+        if f.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            raise Exception('Unknown journal format: %s' % journalPath)
+        end = f.tell()
+        while True:
+            frame = f.read(RECORD_FRAME.size)
+            if len(frame) < RECORD_FRAME.size:
+                break
+            size, crc = RECORD_FRAME.unpack(frame)
+            payload = f.read(size)
+            if len(payload) < size or zlib.crc32(payload) != crc:
+                break
+            records.append(__decodeRecord(payload))
+            end = f.tell()
+    if not records or records[0][0].get('action') != 'begin':
+        raise Exception('Illegal journal: %s' % journalPath)
+    if records[0][0].get('version', 0) > JOURNAL_VERSION:
+        raise Exception('Journal version %s is not supported.' % records[0][0].get('version'))
+    return records, end
+
+
+def __decodeRecord(payload):
+    payload = io.BytesIO(payload)
+    size, = struct.unpack('<I', payload.read(4))
+    header = json.loads(payload.read(size).decode('utf-8'))
+    arrays = {}
+    for name in header.get('arrays', []):
+        arrays[name] = np.lib.format.read_array(payload, allow_pickle=False)
+    return header, arrays
+
+
+def replayJournal(project: dict, records, actions=None):
+    '''
+    replay the records on the project read by loadProject (before it's decoded), it's changed in place.
+    Args:
+        project: dict, the project, its label_image is replaced by the label edits
+        records: list of (header, arrays), from readJournal
+        actions: tuple of the actions replayed, such as PROJECT_ACTIONS or LABEL_ACTIONS, default all of them
+
+    Returns: dict, the project
+
+    '''
+    begin = records[0][0]
+    # the uid of the polygons in project when the journal began
+    uids = begin.get('polygon_uids') or []
+    polygons = project.get('polygon') or []
+    if len(uids) == len(polygons):
+        for polygon, uid in zip(polygons, uids):
+            polygon['uid'] = uid
+    for header, arrays in records[1:]:
+        action = header['action']
+        if actions is not None and action not in actions:
+            continue
+        if action == 'set':
+            project[header['key']] = header['value']
+        elif action == 'polygon_add':
+            project['polygon'] = (project.get('polygon') or []) + [header['polygon']]
+        elif action == 'polygon_delete':
+            project['polygon'] = [polygon for polygon in project.get('polygon') or []
+                                  if polygon.get('uid') != header['uid']]
+        elif action == 'labels':
+            project['label_image'] = __replayLabels(project.get('label_image'), header, arrays)
+        else:
+            print('Unknown action in journal: %s' % action)
+    return project
+
+
+def __replayLabels(labelImage, header, arrays):
+    shape = tuple(header['shape'])
+    r0, r1, c0, c1 = header['window']
+    window = decodeLabelRuns((r1 - r0, c1 - c0), arrays['values'], arrays['lengths'])
+    if labelImage is None or labelImage.shape != shape:
+        # the label image is cut or padded to the image, the same as the label image of project is shown
+        mask = np.zeros(shape, dtype=labelImage.dtype if labelImage is not None and labelImage.ndim == 2
+                        else labelDtype(0))
+        if labelImage is not None and labelImage.ndim == 2:
+            h, w = min(shape[0], labelImage.shape[0]), min(shape[1], labelImage.shape[1])
+            mask[:h, :w] = labelImage[:h, :w]
+        labelImage = mask
+    if 'lut' in arrays:
+        labelImage = arrays['lut'][labelImage]
+    dtype = np.promote_types(labelImage.dtype, window.dtype)
+    if dtype != labelImage.dtype:
+        labelImage = labelImage.astype(dtype)
+    labelImage[r0:r1, c0:c1] = window
+    return labelImage
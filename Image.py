@@ -13,7 +13,9 @@
 
 import numpy as np
 from PyQt5.QtGui import QImage, QPolygonF
-from skimage import filters, measure, color, morphology, draw, segmentation
+from skimage import filters, measure, color, morphology, segmentation
+
+from ImageAnalysis import polygon2mask
 
 
 def narray2qimage(img):
@@ -50,6 +52,23 @@ def qimage2narray(qimage):
     return img
 
 
+def qpolygon2narray(polygon: QPolygonF):
+    '''
+    convert QPolygonF into numpy array.
+    Args:
+        polygon: QPolygonF
+
+    Returns: np.array, (N, 2), vertices in (x, y)
+
+    '''
+    if not polygon:
+        return np.zeros((0, 2), dtype=float)
+    # QPolygonF is a contiguous array of QPointF, two doubles for each point
+    arrayptr = polygon.data()
+    arrayptr.setsize(len(polygon) * 2 * 8)
+    return np.frombuffer(arrayptr, dtype=np.float64).reshape(-1, 2).copy()
+
+
 def imageWithPolygon2Label(img: QImage, polygon: QPolygonF, remove_small_objects=64, remove_small_holes=64):
     '''
     convert image with mask to label image.
@@ -66,7 +85,7 @@ def imageWithPolygon2Label(img: QImage, polygon: QPolygonF, remove_small_objects
     # convert image into gray mode if it's rgb mode.
     gray = color.rgb2gray(imgArr)
     # polygon to binary mask
-    mask = __QPolygon2Mask(gray.shape, polygon)
+    mask = polygon2mask(gray.shape, qpolygon2narray(polygon))
     # __otsuWithMask2bw
     bw = __otsuWithMask2bw(gray, mask)
     # remove small objects
@@ -84,6 +103,8 @@ def imageLabelProperty(labelMask: np.array):
 def imageLabelMerge(oldLabel, newLabel):
     '''
     merge labels with no repeat label id.
+    The new labels are shifted after the old ones, and the new label clashed with old label is mapped to the old
+    label at its first clashed pixel. All of them are done with one label-to-label mapping array.
     Args:
         oldLabel:
         newLabel:
@@ -96,16 +117,15 @@ def imageLabelMerge(oldLabel, newLabel):
     if oldLabel.shape != newLabel.shape:
         raise Exception('New label mask and old label mask must have the same size.')
 
-    newLabel, fw, inv = segmentation.relabel_sequential(newLabel, offset=oldLabel.max() + 1)
     indexClashedInNewLabel = np.logical_and(newLabel > 0, oldLabel > 0)
+    # label-to-label mapping of new label
+    lut = np.zeros(newLabel.max() + 1, dtype=np.int64)
+    newLabelIds = np.flatnonzero(np.bincount(newLabel.ravel(), minlength=lut.size))
+    newLabelIds = newLabelIds[newLabelIds > 0]
+    lut[newLabelIds] = oldLabel.max() + 1 + np.arange(newLabelIds.size)
     newLabelClashed, indexN = np.unique(newLabel[indexClashedInNewLabel], return_index=True)
-    newLabelClashed = newLabelClashed[np.argsort(indexN)]
-    oldLabelClashed, indexO = np.unique(oldLabel[indexClashedInNewLabel], return_index=True)
-    oldLabelClashed = oldLabelClashed[np.argsort(indexO)]
-
-    for i in range(len(newLabelClashed)):
-        newLabel[newLabel == newLabelClashed[i]] = oldLabelClashed[i]
-
+    lut[newLabelClashed] = oldLabel[indexClashedInNewLabel][indexN]
+    newLabel = lut[newLabel]
     newLabel[indexClashedInNewLabel] = 0
     returnLabel, fw, inv = segmentation.relabel_sequential(oldLabel + newLabel)
     return returnLabel
@@ -136,14 +156,6 @@ def __otsuWithMask2bw(img: np.array, mask: np.array):
     return bw
 
 
-def __QPolygon2Mask(imageShape: np.array, polygon: QPolygonF):
-    poa = np.empty([len(polygon), 2])
-    for i, p in enumerate(polygon):
-        poa[i, :] = [p.x(), p.y()]
-        # poa = np.append(poa, [p.x(), p.y()])
-    return draw.polygon2mask(imageShape, poa)
-
-
 def __label2polygon(labelImage):
     '''
     convert label image into QPolygon list
@@ -158,6 +170,18 @@ def __label2polygon(labelImage):
 
 if __name__ == '__main__':
     print('开始处理')
+    # orientation of imageWithPolygon2Label, the rows of label are y and the columns are x of the polygon.
+    # The bright stripe is in rows 10-15, the polygon covers x in [20, 80) and y in [5, 25)
+    from PyQt5.QtCore import QPointF
+    from qimage2ndarray import array2qimage
+
+    stripe = np.full([60, 100], 20, dtype=np.uint8)
+    stripe[10:16] = 220
+    polygon = QPolygonF([QPointF(20, 5), QPointF(80, 5), QPointF(80, 25), QPointF(20, 25)])
+    rows, cols = np.nonzero(imageWithPolygon2Label(array2qimage(np.dstack([stripe] * 3)), polygon))
+    print('Label rows: %d-%d, columns: %d-%d, Orientation: %s' % (
+        rows.min(), rows.max(), cols.min(), cols.max(),
+        (rows.min(), rows.max(), cols.min(), cols.max()) == (10, 15, 20, 79)))
     # img_path = './res/SY3.JPG'
     # # # load image with QImage
     # img = QImage(img_path)
@@ -192,4 +216,20 @@ if __name__ == '__main__':
     # ])
     # c = imageLabelMerge(a, b)
     # print(c)
-    pass
+
+    # benchmark of imageLabelMerge, the time should grow linearly with the number of labels
+    import time
+
+    for n in [1000, 4000, 16000, 64000]:
+        side = int(np.ceil(np.sqrt(n)))
+        # n blocks of 3x3 pixels in a grid, the new blocks are shifted by one pixel to clash with the old ones
+        block = np.zeros([4, 4], dtype=int)
+        block[:3, :3] = 1
+        grid = np.kron(np.arange(1, side * side + 1).reshape(side, side), block)
+        grid[grid > n] = 0
+        oldLabel = grid[:-1, :-1]
+        newLabel = grid[1:, 1:]
+        start = time.time()
+        imageLabelMerge(oldLabel, newLabel)
+        cost = time.time() - start
+        print('Labels: %d, Pixels: %d, Time: %.3f s, %.2f us per label' % (n, oldLabel.size, cost, cost / n * 1e6))
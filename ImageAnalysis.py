@@ -0,0 +1,964 @@
+#!/usr/bin/python3
+# -*-coding:utf-8 -*-
+
+# Reference: **********************************************
+# @Project   : code
+# @File    : ImageAnalysis.py
+# @Time    : 2026/10/18 9:12
+# @License   : LGPL
+# @Author   : Dorad
+# @Email    : cug.xia@gmail.com
+# @Blog      : https://blog.cuger.cn
+
+'''
+GUI-free analysis engine.
+
+All the functions in this module work on numpy arrays only, images are (H, W) gray or (H, W, 3|4) RGB(A) arrays
+and polygons are (N, 2) arrays of (x, y) vertices in image pixels, so they can be used without a QApplication.
+'''
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from skimage import color, filters, measure
+
+REGION_PROPERTIES = ['label', 'centroid_row', 'centroid_col', 'area', 'perimeter', 'orientation',
+                     'major_axis_length', 'minor_axis_length']
+
+# bytes of temporary arrays for each pixel of a tile: RGB to gray (up to 24 for float images), gray (8), masks (2),
+# label int64 (8) and the output window (8), with some room for the copies made by skimage.
+TILE_BYTES_PER_PIXEL = 64
+TILE_MIN_SIZE = 64
+
+# fixed-point (Q15) coefficients of luma, the same as skimage.color.rgb2gray: 0.2125 R + 0.7154 G + 0.0721 B
+LUMA_COEFFICIENTS = (6963, 23442, 2363)
+LUMA_SHIFT = 15
+# rows converted at once by image2grayUint8, it bounds the uint32 temporary arrays
+LUMA_CHUNK_ROWS = 512
+# columns rasterized at once by polygon2bboxMask, it bounds the (columns, edges) temporary arrays
+POLYGON_CHUNK_COLUMNS = 1024
+# dtypes of the label image, the narrowest one fitting the max label id is used
+LABEL_DTYPES = (np.uint16, np.uint32, np.uint64)
+# rows encoded at once by encodeLabelRuns, it bounds the temporary arrays and the length of a run
+LABEL_RUN_CHUNK_ROWS = 1024
+# rows reduced at once by regionStatistics
+REGION_CHUNK_ROWS = 1024
+# bytes of temporary arrays for each pixel of the rows reduced at once, if all of them are labeled: index, row, column
+# and label (32), the float64 moments with their lookups (48), the margin window and the perimeter masks (16)
+REGION_BYTES_PER_PIXEL = 96
+
+# weights of the border pixel codes, the same as skimage.measure.perimeter with 4-neighbourhood
+PERIMETER_WEIGHTS = np.zeros(50)
+PERIMETER_WEIGHTS[[5, 7, 15, 17, 25, 27]] = 1
+PERIMETER_WEIGHTS[[21, 33]] = np.sqrt(2)
+PERIMETER_WEIGHTS[[13, 23]] = (1 + np.sqrt(2)) / 2
+
+
+def image2gray(img: np.array):
+    '''
+    convert image into gray mode if it's rgb mode.
+    Args:
+        img: np.array, (H, W) gray image or (H, W, 3|4) RGB(A) image
+
+    Returns: np.array, (H, W) gray image, uint8 for uint8 RGB image
+
+    '''
+    if img.ndim == 2:
+        return img
+    if img.dtype == np.uint8:
+        return image2grayUint8(img)
+    return color.rgb2gray(img[:, :, :3])
+
+
+def image2grayUint8(img: np.array):
+    '''
+    convert uint8 RGB(A) image into uint8 gray image with fixed-point luma, the rows are converted chunk by chunk.
+    Args:
+        img: np.array, (H, W, 3|4), uint8
+
+    Returns: np.array, (H, W), uint8
+
+    '''
+    gray = np.empty(img.shape[:2], dtype=np.uint8)
+    for r0 in range(0, img.shape[0], LUMA_CHUNK_ROWS):
+        chunk = img[r0:r0 + LUMA_CHUNK_ROWS]
+        acc = np.full(chunk.shape[:2], 1 << (LUMA_SHIFT - 1), dtype=np.uint32)
+        for channel, coefficient in enumerate(LUMA_COEFFICIENTS):
+            acc += chunk[:, :, channel].astype(np.uint32) * np.uint32(coefficient)
+        gray[r0:r0 + LUMA_CHUNK_ROWS] = acc >> LUMA_SHIFT
+    return gray
+
+
+def polygon2mask(imageShape, polygon: np.array):
+    '''
+    convert polygon into binary mask.
+    Args:
+        imageShape: (H, W) of the image
+        polygon: np.array, (N, 2), vertices in (x, y)
+
+    Returns: np.array, (H, W), binary mask
+
+    '''
+    return polygon2windowMask(imageShape, polygon, (0, 0, imageShape[0], imageShape[1]))
+
+
+def polygon2windowMask(imageShape, polygon: np.array, window):
+    '''
+    binary mask of polygon inside a window of the image.
+    Args:
+        imageShape: (H, W) of the image
+        polygon: np.array, (N, 2), vertices in (x, y)
+        window: (r0, c0, r1, c1) of the window
+
+    Returns: np.array, (r1 - r0, c1 - c0), binary mask
+
+    '''
+    r0, c0, r1, c1 = window
+    mask = np.zeros((r1 - r0, c1 - c0), dtype=bool)
+    bboxMask, (mr, mc) = polygon2bboxMask(imageShape, polygon, window)
+    mask[mr - r0:mr - r0 + bboxMask.shape[0], mc - c0:mc - c0 + bboxMask.shape[1]] = bboxMask
+    return mask
+
+
+def polygon2bboxMask(imageShape, polygon: np.array, window=None):
+    '''
+    binary mask of polygon inside its bounding box, only the scanlines of the bounding box are filled.
+    The pixels inside are the same as skimage.draw.polygon2mask([W, H], polygon).transpose(),
+    which scans the columns (x) and counts the crossings below each pixel.
+    Args:
+        imageShape: (H, W) of the image
+        polygon: np.array, (N, 2), vertices in (x, y)
+        window: (r0, c0, r1, c1), optional, the bounding box is clipped by the window
+
+    Returns: (mask, (r0, c0)), binary mask of the bounding box and its offset in the image
+
+    '''
+    r0, c0, r1, c1 = polygonWindow(imageShape, polygon)
+    if window:
+        r0, c0, r1, c1 = max(r0, window[0]), max(c0, window[1]), min(r1, window[2]), min(c1, window[3])
+    if r0 >= r1 or c0 >= c1 or len(polygon) < 3:
+        return np.zeros((0, 0), dtype=bool), (max(r0, 0), max(c0, 0))
+    xs, ys = polygon[:, 0].astype(float), polygon[:, 1].astype(float)
+    # edges from vertex j = i - 1 to vertex i
+    xi, yi = xs, ys
+    xj, yj = np.roll(xs, 1), np.roll(ys, 1)
+    mask = np.zeros((c1 - c0, r1 - r0), dtype=bool)
+    for x0 in range(c0, c1, POLYGON_CHUNK_COLUMNS):
+        x = np.arange(x0, min(x0 + POLYGON_CHUNK_COLUMNS, c1), dtype=float)[:, np.newaxis]
+        crossed = ((xi <= x) & (x < xj)) | ((xj <= x) & (x < xi))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            y = (yj - yi) * (x - xi) / (xj - xi) + yi
+        y = np.sort(np.where(crossed, y, np.inf), axis=1)
+        # pixel is inside if the crossings below it are odd, y in [y0, y1), [y2, y3), ...
+        start, stop = y[:, 0::2], y[:, 1::2]
+        rows, pairs = np.nonzero(np.isfinite(start))
+        start = np.clip(np.ceil(start[rows, pairs]) - r0, 0, r1 - r0).astype(int)
+        stop = np.clip(np.ceil(stop[rows, pairs]) - r0, 0, r1 - r0).astype(int)
+        diff = np.zeros((x.shape[0], r1 - r0 + 1), dtype=np.int32)
+        np.add.at(diff, (rows, start), 1)
+        np.add.at(diff, (rows, stop), -1)
+        mask[x0 - c0:x0 - c0 + x.shape[0]] = np.cumsum(diff[:, :-1], axis=1) > 0
+    return np.ascontiguousarray(mask.transpose()), (r0, c0)
+
+
+def otsuWithMask2bw(img: np.array, mask: np.array):
+    '''
+    convert image with mask to binary image using otsu method.
+    Args:
+        img: np.array, two dimensions, gray image
+        mask: np.array, two dimensions, binary image
+
+    Returns: np.array, binary image
+
+    '''
+    if img.dtype == np.uint8:
+        # threshold from the histogram, without copies of masked array
+        otsu = histogramOtsuThreshold(maskedHistogram(img, mask))
+        return (img >= otsu) & mask
+    # calculate the threshold for the image under mask
+    masked = np.ma.masked_array(img, mask == 0)
+    otsu = filters.threshold_otsu(masked.compressed())
+    # convert gray image under mask into binary image
+    maskedImage = masked.filled(fill_value=0)
+    bw = maskedImage >= otsu
+    return bw
+
+
+def maskedHistogram(gray: np.array, mask: np.array):
+    '''
+    histogram of uint8 gray image under mask.
+    Args:
+        gray: np.array, two dimensions, uint8
+        mask: np.array, two dimensions, binary image
+
+    Returns: np.array, (256,), counts of each gray value
+
+    '''
+    return np.bincount(gray[mask], minlength=256)
+
+
+def histogramOtsuThreshold(hist: np.array):
+    '''
+    threshold of otsu method from the histogram of integer image,
+    the same as skimage.filters.threshold_otsu of the pixels counted in the histogram.
+    Args:
+        hist: np.array, counts of each gray value
+
+    Returns: int, threshold
+
+    '''
+    values = np.flatnonzero(hist)
+    low, high = values[0], values[-1]
+    if low == high:
+        return low
+    return otsuThreshold(hist[low:high + 1], np.arange(low, high + 1))
+
+
+def polygonAreaLabel(gray: np.array, polygon: np.array, cropPolygon: np.array = None):
+    '''
+    detect the shear damage zones inside one ROI using otsu method.
+    Args:
+        gray: np.array, (H, W), gray image
+        polygon: np.array, (N, 2), ROI
+        cropPolygon: np.array, (N, 2), the crop polygon, optional
+
+    Returns: np.array, (H, W), label image
+
+    '''
+    label = np.zeros(gray.shape, dtype=int)
+    windowLabel, (r0, c0) = polygonAreaWindowLabel(gray, polygon, cropPolygon)
+    label[r0:r0 + windowLabel.shape[0], c0:c0 + windowLabel.shape[1]] = windowLabel
+    return label
+
+
+def polygonAreaWindowLabel(image: np.array, polygon: np.array, cropPolygon: np.array = None):
+    '''
+    detect the shear damage zones inside one ROI using otsu method, only the bounding box of the ROI is processed.
+    Args:
+        image: np.array, gray or RGB(A) image
+        polygon: np.array, (N, 2), ROI
+        cropPolygon: np.array, (N, 2), the crop polygon, optional
+
+    Returns: (label, (r0, c0)), label image of the bounding box and its offset in the image
+
+    '''
+    r0, c0, r1, c1 = polygonWindow(image.shape, polygon)
+    if r0 >= r1 or c0 >= c1:
+        return np.zeros((0, 0), dtype=int), (0, 0)
+    gray, mask = tileGrayAndMask(image, (r0, c0, r1, c1), polygon, cropPolygon)
+    if not mask.any():
+        return np.zeros(mask.shape, dtype=int), (r0, c0)
+    bw = otsuWithMask2bw(gray, mask)
+    return measure.label(bw, connectivity=2), (r0, c0)
+
+
+def rissPolygonsThreshold(gray: np.array, polygons):
+    '''
+    threshold of Riss method, mean + 1.96 * std of the gray values inside the ROIs.
+    Binary Images of Sheared Rock Joints: Characterization of Damaged Zones, doi: 10.1051/mmm:1996153
+    Args:
+        gray: np.array, (H, W), gray image
+        polygons: list of np.array, ROIs
+
+    Returns: float, threshold
+
+    '''
+    mask = np.zeros(gray.shape, dtype=bool)
+    for polygon in polygons:
+        polygonMask, (r0, c0) = polygon2bboxMask(gray.shape, polygon)
+        mask[r0:r0 + polygonMask.shape[0], c0:c0 + polygonMask.shape[1]] |= polygonMask
+    pixels = gray[mask]
+    return np.mean(pixels) + 1.96 * np.std(pixels)
+
+
+def rissPolygonsLabel(gray: np.array, polygons, cropPolygon: np.array = None, threshold=None):
+    '''
+    detect the shear damage zones using Riss method.
+    Args:
+        gray: np.array, (H, W), gray image
+        polygons: list of np.array, ROIs used to estimate the threshold
+        cropPolygon: np.array, (N, 2), the crop polygon, optional
+        threshold: float, threshold calculated before, optional
+
+    Returns: np.array, (H, W), label image
+
+    '''
+    if threshold is None:
+        threshold = rissPolygonsThreshold(gray, polygons)
+    binary = gray > threshold
+    if cropPolygon is not None and len(cropPolygon):
+        binary &= polygon2mask(gray.shape, cropPolygon)
+    return measure.label(binary, connectivity=2)
+
+
+def labelMerge(oldLabel: np.array, newLabel: np.array):
+    '''
+    merge two label images, regions connected to each other are merged into one.
+    Args:
+        oldLabel: np.array, label image
+        newLabel: np.array, label image
+
+    Returns: merged label image
+
+    '''
+    if not newLabel.any():
+        return oldLabel
+    return measure.label((oldLabel > 0) | (newLabel > 0), connectivity=2, background=0)
+
+
+def labelDtype(maxLabel):
+    '''
+    the narrowest dtype in LABEL_DTYPES which fits the label ids.
+    Args:
+        maxLabel: int, the max label id
+
+    Returns: np.dtype
+
+    '''
+    for dtype in LABEL_DTYPES:
+        if maxLabel <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    raise Exception('Too many labels: %d' % maxLabel)
+
+
+def compactLabels(labelMask: np.array, maxLabel=None):
+    '''
+    label image in the narrowest dtype, it's not copied if it's already in that dtype.
+    Args:
+        labelMask: np.array, label image
+        maxLabel: int, the max label id, optional
+
+    Returns: np.array, label image
+
+    '''
+    if maxLabel is None:
+        maxLabel = int(labelMask.max(initial=0))
+    return labelMask.astype(labelDtype(maxLabel), copy=False)
+
+
+def encodeLabelRuns(labelMask: np.array):
+    '''
+    run-length encoding of the label image in raster order, the runs of background are included, so the number of
+    runs is about the length of the region borders along the rows. The runs are split at each LABEL_RUN_CHUNK_ROWS
+    rows, the image is decoded exactly by decodeLabelRuns.
+    Args:
+        labelMask: np.array, (H, W), label image
+
+    Returns: (values, lengths), np.array of label id (dtype of label image) and length (uint32 or uint64) of runs
+
+    '''
+    h, w = labelMask.shape
+    lengthDtype = np.uint32 if LABEL_RUN_CHUNK_ROWS * w <= np.iinfo(np.uint32).max else np.uint64
+    values, lengths = [], []
+    for r0 in range(0, h, LABEL_RUN_CHUNK_ROWS):
+        flat = np.ascontiguousarray(labelMask[r0:r0 + LABEL_RUN_CHUNK_ROWS]).reshape(-1)
+        if not flat.size:
+            continue
+        starts = np.concatenate([[0], np.flatnonzero(flat[1:] != flat[:-1]) + 1])
+        values.append(flat[starts])
+        lengths.append(np.diff(np.append(starts, flat.size)).astype(lengthDtype))
+    if not values:
+        return np.zeros(0, dtype=labelMask.dtype), np.zeros(0, dtype=lengthDtype)
+    return np.concatenate(values), np.concatenate(lengths)
+
+
+def decodeLabelRuns(shape, values: np.array, lengths: np.array):
+    '''
+    label image of the runs from encodeLabelRuns.
+    Args:
+        shape: (H, W), shape of the label image
+        values: np.array, label id of runs
+        lengths: np.array, length of runs
+
+    Returns: np.array, (H, W), label image in the narrowest dtype
+
+    '''
+    if int(np.sum(lengths, dtype=np.uint64)) != int(np.prod(shape)):
+        raise Exception('The runs do not match the shape of label image.')
+    values = compactLabels(np.asarray(values))
+    return np.repeat(values, np.asarray(lengths, dtype=np.intp)).reshape(shape)
+
+
+def labelMergeWindow(labelMask: np.array, newLabel: np.array, offset=(0, 0), maxLabel=None, returnLut=False):
+    '''
+    merge the label of a window into the label mask in place, only the window (with 1 pixel margin) is labeled.
+    The label mask is copied to a wider dtype only if the new label ids don't fit its dtype.
+    The local regions and the exist labels they touch are united through a union-find table, the exist labels
+    keep their id and the new regions get new ids after maxLabel. Only if the new regions bridge several exist
+    labels, the whole label mask is relabeled with a lookup table and the ids are kept sequential.
+    Args:
+        labelMask: np.array, (H, W), label image, it's changed in place if the new ids fit its dtype
+        newLabel: np.array, label image of the window
+        offset: (row, col) of the window in the label mask
+        maxLabel: int, the max label id of label mask, optional
+        returnLut: bool, also return the lookup table of the relabel, None if the label mask is not relabeled
+
+    Returns: (labelMask, maxLabel) or (labelMask, maxLabel, lut)
+
+    '''
+    if maxLabel is None:
+        maxLabel = int(labelMask.max()) if labelMask.size else 0
+    lut = None
+    if not newLabel.any():
+        return (labelMask, maxLabel, lut) if returnLut else (labelMask, maxLabel)
+    h, w = newLabel.shape
+    r0, c0 = offset
+    # window with 1 pixel margin, the new regions could touch the exist regions around the window
+    wr0, wc0 = max(0, r0 - 1), max(0, c0 - 1)
+    wr1, wc1 = min(labelMask.shape[0], r0 + h + 1), min(labelMask.shape[1], c0 + w + 1)
+    old = labelMask[wr0:wr1, wc0:wc1]
+    union = old > 0
+    union[r0 - wr0:r0 - wr0 + h, c0 - wc0:c0 - wc0 + w] |= newLabel > 0
+    local, num = measure.label(union, connectivity=2, return_num=True)
+    # union-find table, nodes are local regions (0..num) and the exist labels in the window
+    overlap = old > 0
+    oldIds, oldIndex = np.unique(old[overlap], return_inverse=True)
+    nodes = num + 1 + oldIds.size
+    pairs = np.unique(local[overlap].astype(np.int64) * max(oldIds.size, 1) + oldIndex.reshape(-1))
+    pairs = (pairs // max(oldIds.size, 1), num + 1 + pairs % max(oldIds.size, 1))
+    graph = coo_matrix((np.ones(pairs[0].size, dtype=bool), pairs), shape=(nodes, nodes))
+    count, component = connected_components(graph, directed=False)
+    # each component keeps the smallest exist label id, or gets a new id
+    componentId = np.full(count, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(componentId, component[num + 1:], oldIds)
+    newComponents = np.unique(component[1:num + 1][componentId[component[1:num + 1]] == np.iinfo(np.int64).max])
+    componentId[newComponents] = maxLabel + 1 + np.arange(newComponents.size)
+    maxLabel += newComponents.size
+    if maxLabel > np.iinfo(labelMask.dtype).max:
+        labelMask = labelMask.astype(labelDtype(maxLabel))
+    localId = componentId[component[:num + 1]]
+    localId[0] = 0
+    labelMask[wr0:wr1, wc0:wc1] = localId[local]
+    # exist labels bridged by the new regions
+    mergedId = componentId[component[num + 1:]]
+    merged = mergedId != oldIds
+    if merged.any():
+        lut = np.arange(maxLabel + 1, dtype=np.int64)
+        lut[oldIds[merged]] = mergedId[merged]
+        # keep the ids sequential
+        kept = np.ones(maxLabel + 1, dtype=bool)
+        kept[oldIds[merged]] = False
+        lut = (np.cumsum(kept) - 1)[lut]
+        labelMask[...] = lut[labelMask]
+        maxLabel -= int(merged.sum())
+    return (labelMask, maxLabel, lut) if returnLut else (labelMask, maxLabel)
+
+
+def analyseImage(image: np.array, polygons, cropPolygon: np.array = None, method='otsu'):
+    '''
+    detect the shear damage zones of the whole image, the same as Analysis of the main window.
+    Args:
+        image: np.array, gray or RGB(A) image
+        polygons: list of np.array, ROIs
+        cropPolygon: np.array, (N, 2), the crop polygon, optional
+        method: 'otsu' or 'riss'
+
+    Returns: np.array, (H, W), label image
+
+    '''
+    gray = image2gray(image)
+    labelMask = np.zeros(gray.shape, dtype=labelDtype(0))
+    if not len(polygons):
+        return labelMask
+    if method == 'otsu':
+        maxLabel = 0
+        for polygon in polygons:
+            label, offset = polygonAreaWindowLabel(gray, polygon, cropPolygon)
+            labelMask, maxLabel = labelMergeWindow(labelMask, label, offset, maxLabel)
+    elif method == 'riss':
+        labelMask = compactLabels(rissPolygonsLabel(gray, polygons, cropPolygon))
+    else:
+        raise Exception('Unknown analysis method: %s' % method)
+    return labelMask
+
+
+def regionStatistics(labelMask: np.array, chunkRows=REGION_CHUNK_ROWS):
+    '''
+    properties of all the regions in label image, computed for all labels at once with bincount, the rows are reduced
+    chunk by chunk. The values are the same as regionprops (see regionStatisticsReference).
+    Args:
+        labelMask: np.array, label image, could be np.memmap
+        chunkRows: int, rows reduced at once, it bounds the temporary arrays (see regionChunkRows)
+
+    Returns: dict of np.array, keys in REGION_PROPERTIES, one item for each region
+
+    '''
+    h, w = labelMask.shape
+    size = int(labelMask.max(initial=0)) + 1 if labelMask.size else 1
+    area = np.zeros(size)
+    sumRow = np.zeros(size)
+    sumCol = np.zeros(size)
+    # area and centroid
+    for r0 in range(0, h, chunkRows):
+        labels, rows, cols = regionPixels(labelMask[r0:r0 + chunkRows], r0)
+        area += np.bincount(labels, minlength=size)
+        sumRow += np.bincount(labels, rows, minlength=size)
+        sumCol += np.bincount(labels, cols, minlength=size)
+    ids = np.flatnonzero(area)
+    centroidRow = sumRow / np.maximum(area, 1)
+    centroidCol = sumCol / np.maximum(area, 1)
+    # central moments and perimeter
+    mu20 = np.zeros(size)
+    mu02 = np.zeros(size)
+    mu11 = np.zeros(size)
+    perimeter = np.zeros(size)
+    for r0 in range(0, h, chunkRows):
+        r1 = min(h, r0 + chunkRows)
+        labels, rows, cols = regionPixels(labelMask[r0:r1], r0)
+        dr = rows - centroidRow[labels]
+        dc = cols - centroidCol[labels]
+        mu20 += np.bincount(labels, dr * dr, minlength=size)
+        mu02 += np.bincount(labels, dc * dc, minlength=size)
+        mu11 += np.bincount(labels, dr * dc, minlength=size)
+        # the chunk with 2 pixels margin, the margin out of image is background
+        window = np.zeros([r1 - r0 + 4, w + 4], dtype=labelMask.dtype)
+        a0, a1 = max(0, r0 - 2), min(h, r1 + 2)
+        window[a0 - r0 + 2:a1 - r0 + 2, 2:-2] = labelMask[a0:a1]
+        labels, codes = perimeterCodes(window)
+        perimeter += np.bincount(labels, PERIMETER_WEIGHTS[codes], minlength=size)
+    # inertia tensor [[a, b], [b, c]], the same as regionprops
+    n = np.maximum(area[ids], 1)
+    a, b, c = mu02[ids] / n, -mu11[ids] / n, mu20[ids] / n
+    orientation = np.where(a - c == 0, np.where(b < 0, np.pi / 4., -np.pi / 4.), 0.5 * np.arctan2(-2 * b, c - a))
+    root = np.sqrt(((a - c) / 2) ** 2 + b ** 2)
+    major = 4 * np.sqrt(np.maximum((a + c) / 2 + root, 0))
+    minor = 4 * np.sqrt(np.maximum((a + c) / 2 - root, 0))
+    return {
+        'label': ids,
+        'centroid_row': centroidRow[ids],
+        'centroid_col': centroidCol[ids],
+        'area': area[ids],
+        'perimeter': perimeter[ids],
+        'orientation': orientation,
+        'major_axis_length': major,
+        'minor_axis_length': minor
+    }
+
+
+def regionChunkRows(width, memoryBudget):
+    '''
+    rows reduced at once by regionStatistics, whose temporary arrays fit into the memory budget.
+    Args:
+        width: int, width of the label image
+        memoryBudget: int, bytes
+
+    Returns: int, rows
+
+    '''
+    return max(1, int(memoryBudget // (max(1, width) * REGION_BYTES_PER_PIXEL)))
+
+
+def componentSizes(bw: np.array, connectivity=2):
+    '''
+    connected components and their sizes, the small blocks (or holes, the components of ~bw) could be removed with
+    any threshold by looking up the sizes, the same as skimage.morphology.remove_small_objects (remove_small_holes).
+    Args:
+        bw: np.array, binary image
+        connectivity: int, 1 or 2
+
+    Returns: (component, sizes), component label image and the size of each component, sizes[0] is 0
+
+    '''
+    component, num = measure.label(bw, connectivity=connectivity, return_num=True)
+    sizes = np.bincount(component.ravel(), minlength=num + 1)
+    sizes[0] = 0
+    return component, sizes
+
+
+def regionPixels(labelMask: np.array, r0=0):
+    '''
+    label, row and column of the labeled pixels.
+    Args:
+        labelMask: np.array, label image or some rows of it
+        r0: int, row of the first row
+
+    Returns: (labels, rows, cols)
+
+    '''
+    labelMask = np.asarray(labelMask)
+    index = np.flatnonzero(labelMask)
+    rows, cols = np.divmod(index, labelMask.shape[1])
+    return labelMask.ravel()[index].astype(np.intp), rows + r0, cols
+
+
+def perimeterCodes(window: np.array):
+    '''
+    codes of the border pixels, 1 + 2 * (4-neighbours) + 10 * (diagonal neighbours) which are the border pixels of
+    the same label. It's the convolution of skimage.measure.perimeter applied to each label.
+    Args:
+        window: np.array, (h + 4, w + 4), label image with 2 pixels margin
+
+    Returns: (labels, codes) of the border pixels inside the margin
+
+    '''
+    center = window[1:-1, 1:-1]
+    hh, ww = center.shape
+    interior = center > 0
+    for dr, dc in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+        interior &= window[1 + dr:1 + dr + hh, 1 + dc:1 + dc + ww] == center
+    border = np.zeros(window.shape, dtype=bool)
+    border[1:-1, 1:-1] = (center > 0) & ~interior
+    inner = window[2:-2, 2:-2]
+    h, w = inner.shape
+    codes = border[2:-2, 2:-2].astype(np.uint8)
+    for dr in [-1, 0, 1]:
+        for dc in [-1, 0, 1]:
+            if dr == 0 and dc == 0:
+                continue
+            weight = np.uint8(2 if dr == 0 or dc == 0 else 10)
+            codes += weight * (border[2 + dr:2 + dr + h, 2 + dc:2 + dc + w] &
+                               (window[2 + dr:2 + dr + h, 2 + dc:2 + dc + w] == inner))
+    select = border[2:-2, 2:-2]
+    return inner[select].astype(np.intp), codes[select]
+
+
+def regionStatisticsReference(labelMask: np.array):
+    '''
+    properties of all the regions with regionprops, the reference of regionStatistics.
+    Args:
+        labelMask: np.array, label image
+
+    Returns: dict of np.array, keys in REGION_PROPERTIES, one item for each region
+
+    '''
+    props = measure.regionprops(labelMask)
+    stats = {}
+    stats['label'] = np.array([p.label for p in props], dtype=int)
+    stats['centroid_row'] = np.array([p.centroid[0] for p in props], dtype=float)
+    stats['centroid_col'] = np.array([p.centroid[1] for p in props], dtype=float)
+    for key in REGION_PROPERTIES[3:]:
+        stats[key] = np.array([getattr(p, key) for p in props], dtype=float)
+    return stats
+
+
+'''
+tiled analysis, for the images which are too large to be processed at once
+'''
+
+
+def tileSizeForBudget(memoryBudget, bytesPerPixel=TILE_BYTES_PER_PIXEL):
+    '''
+    side length of the square tile whose temporary arrays fit into the memory budget.
+    Args:
+        memoryBudget: int, bytes
+        bytesPerPixel: int, bytes of temporary arrays for each pixel
+
+    Returns: int, side length of tile in pixels
+
+    '''
+    return max(TILE_MIN_SIZE, int(np.sqrt(memoryBudget / bytesPerPixel)))
+
+
+def imageTiles(imageShape, tileSize, window=None):
+    '''
+    split the image (or a window of it) into tiles.
+    Args:
+        imageShape: (H, W) of the image
+        tileSize: int, side length of tile
+        window: (r0, c0, r1, c1), optional, only the tiles inside the window
+
+    Returns: generator of (r0, c0, r1, c1)
+
+    '''
+    r0, c0, r1, c1 = window if window else (0, 0, imageShape[0], imageShape[1])
+    for tr in range(r0, r1, tileSize):
+        for tc in range(c0, c1, tileSize):
+            yield tr, tc, min(tr + tileSize, r1), min(tc + tileSize, c1)
+
+
+def polygonWindow(imageShape, polygon: np.array):
+    '''
+    bounding box of polygon inside the image.
+    Args:
+        imageShape: (H, W) of the image
+        polygon: np.array, (N, 2), vertices in (x, y)
+
+    Returns: (r0, c0, r1, c1), empty if r0 >= r1 or c0 >= c1
+
+    '''
+    if not len(polygon):
+        return 0, 0, 0, 0
+    r0 = int(max(0, np.floor(polygon[:, 1].min())))
+    c0 = int(max(0, np.floor(polygon[:, 0].min())))
+    r1 = int(min(imageShape[0], np.ceil(polygon[:, 1].max()) + 1))
+    c1 = int(min(imageShape[1], np.ceil(polygon[:, 0].max()) + 1))
+    return r0, c0, r1, c1
+
+
+def tileGrayAndMask(image: np.array, tile, polygon: np.array, cropPolygon: np.array = None):
+    '''
+    gray image and polygon mask of one tile.
+    Args:
+        image: np.array, gray or RGB(A) image, could be np.memmap
+        tile: (r0, c0, r1, c1)
+        polygon: np.array, (N, 2), vertices in (x, y) of the whole image
+        cropPolygon: np.array, (N, 2), the crop polygon, optional
+
+    Returns: (gray, mask) of the tile
+
+    '''
+    r0, c0, r1, c1 = tile
+    gray = image2gray(image[r0:r1, c0:c1])
+    mask = polygon2windowMask(image.shape, polygon, tile)
+    if cropPolygon is not None and len(cropPolygon):
+        mask &= polygon2windowMask(image.shape, cropPolygon, tile)
+    return gray, mask
+
+
+def otsuThreshold(hist: np.array, binCenters: np.array):
+    '''
+    threshold of otsu method from histogram, the same as skimage.filters.threshold_otsu.
+    Args:
+        hist: np.array, counts of each bin
+        binCenters: np.array, center of each bin
+
+    Returns: float, threshold
+
+    '''
+    hist = hist.astype(float)
+    # class probabilities for all possible thresholds
+    weight1 = np.cumsum(hist)
+    weight2 = np.cumsum(hist[::-1])[::-1]
+    # class means for all possible thresholds
+    mean1 = np.cumsum(hist * binCenters) / weight1
+    mean2 = (np.cumsum((hist * binCenters)[::-1]) / weight2[::-1])[::-1]
+    variance12 = weight1[:-1] * weight2[1:] * (mean1[:-1] - mean2[1:]) ** 2
+    idx = np.argmax(variance12)
+    return binCenters[:-1][idx]
+
+
+def tiledOtsuThreshold(image: np.array, polygon: np.array, cropPolygon: np.array = None, tileSize=1024,
+                       nbins=256):
+    '''
+    threshold of otsu method for the pixels inside the polygon, accumulated tile by tile.
+    Args:
+        image: np.array, gray or RGB(A) image, could be np.memmap
+        polygon: np.array, (N, 2), vertices in (x, y)
+        cropPolygon: np.array, (N, 2), the crop polygon, optional
+        tileSize: int, side length of tile
+        nbins: int, number of bins of histogram, ignored for uint8 image
+
+    Returns: float, threshold, None if no pixel inside the polygon
+
+    '''
+    window = polygonWindow(image.shape, polygon)
+    if image.dtype == np.uint8:
+        # histogram of gray values
+        hist = np.zeros(256, dtype=np.int64)
+        for tile in imageTiles(image.shape, tileSize, window):
+            gray, mask = tileGrayAndMask(image, tile, polygon, cropPolygon)
+            hist += maskedHistogram(gray, mask)
+        return histogramOtsuThreshold(hist) if hist.any() else None
+    # range of the gray value
+    low, high = np.inf, -np.inf
+    for tile in imageTiles(image.shape, tileSize, window):
+        gray, mask = tileGrayAndMask(image, tile, polygon, cropPolygon)
+        if mask.any():
+            low = min(low, gray[mask].min())
+            high = max(high, gray[mask].max())
+    if low > high:
+        return None
+    if low == high:
+        return low
+    # histogram with the same bins as the whole image
+    hist = np.zeros(nbins, dtype=np.int64)
+    for tile in imageTiles(image.shape, tileSize, window):
+        gray, mask = tileGrayAndMask(image, tile, polygon, cropPolygon)
+        hist += np.histogram(gray[mask], bins=nbins, range=(low, high))[0]
+    binEdges = np.histogram_bin_edges([], bins=nbins, range=(low, high))
+    return otsuThreshold(hist, (binEdges[:-1] + binEdges[1:]) / 2.)
+
+
+def tiledRissThreshold(image: np.array, polygons, tileSize=1024):
+    '''
+    threshold of Riss method, mean + 1.96 * std, accumulated tile by tile.
+    Args:
+        image: np.array, gray or RGB(A) image, could be np.memmap
+        polygons: list of np.array, ROIs
+        tileSize: int, side length of tile
+
+    Returns: float, threshold
+
+    '''
+    count, total, totalSquare = 0, 0., 0.
+    for tile in imageTiles(image.shape, tileSize):
+        r0, c0, r1, c1 = tile
+        mask = np.zeros((r1 - r0, c1 - c0), dtype=bool)
+        for polygon in polygons:
+            mask |= polygon2windowMask(image.shape, polygon, tile)
+        if not mask.any():
+            continue
+        pixels = image2gray(image[r0:r1, c0:c1])[mask]
+        count += pixels.size
+        total += np.sum(pixels, dtype=float)
+        totalSquare += np.sum(np.square(pixels, dtype=float))
+    mu = total / count
+    return mu + 1.96 * np.sqrt(max(totalSquare / count - mu * mu, 0.))
+
+
+def tiledLabel(imageShape, tileBinary, tileSize=1024, remove_small_objects=0, out=None):
+    '''
+    label the binary image tile by tile, the regions split by the seams of tiles are stitched into one.
+    Args:
+        imageShape: (H, W) of the image
+        tileBinary: function, (r0, c0, r1, c1) -> binary image of the tile
+        tileSize: int, side length of tile
+        remove_small_objects: int, regions smaller than this are removed
+        out: np.array, (H, W), integer array for the label image, could be np.memmap, optional
+
+    Returns: np.array, (H, W), label image, connectivity is 2
+
+    '''
+    if out is None:
+        out = np.zeros(imageShape, dtype=np.int32)
+    tiles = list(imageTiles(imageShape, tileSize))
+    # label each tile, the label id is unique among all tiles
+    count = 0
+    for tile in tiles:
+        r0, c0, r1, c1 = tile
+        label, num = measure.label(tileBinary(tile), connectivity=2, return_num=True)
+        label[label > 0] += count
+        out[r0:r1, c0:c1] = label
+        count += num
+    # pairs of labels touching each other across the seams, 8 neighbours
+    pairs = []
+    for seam in range(tileSize, imageShape[0], tileSize):
+        pairs += seamPairs(out[seam - 1, :], out[seam, :])
+    for seam in range(tileSize, imageShape[1], tileSize):
+        pairs += seamPairs(out[:, seam - 1], out[:, seam])
+    # union the labels, each connected component of the graph is one region
+    lut = np.arange(count + 1)
+    if pairs:
+        pairs = np.concatenate(pairs, axis=1)
+        graph = coo_matrix((np.ones(pairs.shape[1], dtype=bool), (pairs[0], pairs[1])), shape=(count + 1, count + 1))
+        num, lut = connected_components(graph, directed=False)
+        # background is component of label 0
+        lut = np.where(lut == lut[0], -1, lut)
+        lut = np.unique(lut, return_inverse=True)[1].reshape(-1)
+    # remove small objects with the size of the whole region
+    if remove_small_objects:
+        size = np.zeros(lut.max() + 1, dtype=np.int64)
+        for r0, c0, r1, c1 in tiles:
+            size += np.bincount(lut[out[r0:r1, c0:c1]].ravel(), minlength=size.size)
+        keep = size >= remove_small_objects
+        keep[0] = False
+        lut = np.where(keep[lut], np.cumsum(keep)[lut], 0)
+    for r0, c0, r1, c1 in tiles:
+        out[r0:r1, c0:c1] = lut[out[r0:r1, c0:c1]]
+    return out
+
+
+def seamPairs(a: np.array, b: np.array):
+    '''
+    pairs of labels on the two sides of a seam which are 8-connected.
+    Args:
+        a: np.array, labels of the last row (column) before the seam
+        b: np.array, labels of the first row (column) after the seam
+
+    Returns: list of np.array, (2, N)
+
+    '''
+    pairs = []
+    for shift in [-1, 0, 1]:
+        sa = a[max(0, -shift):a.size - max(0, shift)]
+        sb = b[max(0, shift):b.size - max(0, -shift)]
+        touched = (sa > 0) & (sb > 0)
+        if touched.any():
+            pairs.append(np.vstack([sa[touched], sb[touched]]))
+    return pairs
+
+
+def tiledAnalyseImage(image: np.array, polygons, cropPolygon: np.array = None, method='otsu',
+                      memoryBudget=256 * 2 ** 20, remove_small_objects=0, out=None):
+    '''
+    detect the shear damage zones of the whole image tile by tile, the temporary memory is bounded by the budget.
+    Args:
+        image: np.array, gray or RGB(A) image, could be np.memmap
+        polygons: list of np.array, ROIs
+        cropPolygon: np.array, (N, 2), the crop polygon, optional
+        method: 'otsu' or 'riss'
+        memoryBudget: int, bytes for the temporary arrays of one tile
+        remove_small_objects: int, regions smaller than this (px^2) are removed
+        out: np.array, (H, W), integer array for the label image, could be np.memmap, optional
+
+    Returns: np.array, (H, W), label image
+
+    '''
+    imageShape = image.shape[:2]
+    tileSize = tileSizeForBudget(memoryBudget)
+    hasCrop = cropPolygon is not None and len(cropPolygon)
+    if method == 'otsu':
+        thresholds = [tiledOtsuThreshold(image, polygon, cropPolygon, tileSize) for polygon in polygons]
+        rois = [(polygon, polygonWindow(imageShape, polygon), threshold)
+                for polygon, threshold in zip(polygons, thresholds) if threshold is not None]
+
+        def tileBinary(tile):
+            r0, c0, r1, c1 = tile
+            bw = np.zeros((r1 - r0, c1 - c0), dtype=bool)
+            for polygon, window, threshold in rois:
+                if window[0] >= r1 or window[2] <= r0 or window[1] >= c1 or window[3] <= c0:
+                    continue
+                gray, mask = tileGrayAndMask(image, tile, polygon, cropPolygon)
+                bw |= mask & (gray >= threshold)
+            return bw
+    elif method == 'riss':
+        threshold = tiledRissThreshold(image, polygons, tileSize)
+
+        def tileBinary(tile):
+            r0, c0, r1, c1 = tile
+            bw = image2gray(image[r0:r1, c0:c1]) > threshold
+            if hasCrop:
+                bw &= polygon2windowMask(imageShape, cropPolygon, tile)
+            return bw
+    else:
+        raise Exception('Unknown analysis method: %s' % method)
+    return tiledLabel(imageShape, tileBinary, tileSize, remove_small_objects, out)
+
+
+if __name__ == '__main__':
+    # regionStatistics against regionprops, the time of regionStatistics should not grow with the number of labels
+    import time
+
+    rng = np.random.default_rng(0)
+    for n in [1000, 10000]:
+        side = int(np.ceil(np.sqrt(n))) * 4
+        labelMask = measure.label(rng.random([side, side]) > 0.72, connectivity=1)
+        start = time.time()
+        stats = regionStatistics(labelMask)
+        cost = time.time() - start
+        start = time.time()
+        reference = regionStatisticsReference(labelMask)
+        costReference = time.time() - start
+        # the orientation of the regions without covariance could be pi / 2 or -pi / 2 in regionprops, by rounding error
+        same = all(np.allclose(stats[key], reference[key]) for key in REGION_PROPERTIES if key != 'orientation') and \
+               np.allclose(np.sin(2 * stats['orientation']), np.sin(2 * reference['orientation'])) and \
+               np.allclose(np.cos(2 * stats['orientation']), np.cos(2 * reference['orientation']))
+        print('Labels: %d, Time: %.3f s, regionprops: %.3f s, Same: %s' % (
+            len(stats['label']), cost, costReference, same))
+
+    # the peak memory of the tiled analysis and the statistics of a 4000 x 3000 label memmap should be near the budget
+    import os
+    import tempfile
+    import tracemalloc
+
+    memoryBudget = 16 * 2 ** 20
+    h, w = 4000, 3000
+    with tempfile.TemporaryDirectory() as directory:
+        image = np.lib.format.open_memmap(os.path.join(directory, 'image.npy'), mode='w+', dtype=np.uint8,
+                                          shape=(h, w))
+        for r0 in range(0, h, 500):
+            image[r0:r0 + 500] = rng.integers(0, 256, size=image[r0:r0 + 500].shape, dtype=np.uint8)
+        polygon = np.array([[100, 100], [100, w - 100], [h - 100, w - 100], [h - 100, 100]], dtype=float)
+        labelMask = np.lib.format.open_memmap(os.path.join(directory, 'label.npy'), mode='w+', dtype=np.int32,
+                                              shape=(h, w))
+        tracemalloc.start()
+        tiledAnalyseImage(image, [polygon], memoryBudget=memoryBudget, out=labelMask)
+        peakAnalysis = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        stats = regionStatistics(labelMask, chunkRows=regionChunkRows(w, memoryBudget))
+        peakStatistics = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('Budget: %.1f MB, Peak of analysis: %.1f MB, Peak of statistics: %.1f MB, Within budget: %s' % (
+            memoryBudget / 2 ** 20, peakAnalysis / 2 ** 20, peakStatistics / 2 ** 20,
+            max(peakAnalysis, peakStatistics) <= memoryBudget))
+        del image, labelMask
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+# -*-coding:utf-8 -*-
+
+# Reference: **********************************************
+# @Project   : code
+# @File    : ImageCache.py
+# @Time    : 2026/10/18 11:20
+# @License   : LGPL
+# @Author   : Dorad
+# @Email    : cug.xia@gmail.com
+# @Blog      : https://blog.cuger.cn
+
+from collections import OrderedDict
+
+import numpy as np
+
+from ImageAnalysis import image2gray
+
+
+class DerivedImageCache(object):
+    '''
+    cache of the data derived from one image, such as gray image, histogram and pyramid.
+    The items are evicted in least recently used order when the total size is over maxBytes.
+    '''
+
+    def __init__(self, maxBytes=1024 * 2 ** 20):
+        self.maxBytes = maxBytes
+        self.image = None
+        self.items = OrderedDict()
+        self.nbytes = 0
+
+    def setImage(self, image: np.array):
+        '''
+        set the image, all the data derived from the old image are invalidated.
+        Args:
+            image: np.array, gray or RGB(A) image, it should not be changed while it's in the cache
+
+        Returns:
+
+        '''
+        self.clear()
+        self.image = image
+
+    def clear(self):
+        self.items.clear()
+        self.nbytes = 0
+
+    def get(self, key, builder):
+        '''
+        get item from cache, it's built and cached if it's not in the cache.
+        Args:
+            key: key of item
+            builder: function to build the item
+
+        Returns: item
+
+        '''
+        if key in self.items:
+            self.items.move_to_end(key)
+            return self.items[key]
+        item = builder()
+        size = DerivedImageCache.__sizeOf(item)
+        if size > self.maxBytes:
+            return item
+        self.items[key] = item
+        self.nbytes += size
+        # evict the least recently used items
+        while self.nbytes > self.maxBytes:
+            oldKey, oldItem = self.items.popitem(last=False)
+            self.nbytes -= DerivedImageCache.__sizeOf(oldItem)
+        return item
+
+    def gray(self):
+        '''
+        gray image, (H, W).
+        '''
+        return self.get('gray', lambda: image2gray(self.image))
+
+    def histogram(self):
+        '''
+        histogram of gray image, 256 bins, one bin for each value of uint8 gray image or in [0, 1] for float image.
+        '''
+
+        def build():
+            gray = self.gray()
+            if gray.dtype == np.uint8:
+                return np.bincount(gray.ravel(), minlength=256)
+            return np.histogram(gray, bins=256, range=(0., 1.))[0]
+
+        return self.get('histogram', build)
+
+    def pyramid(self, level):
+        '''
+        gray image downsampled by 2 ** level with mean of the blocks.
+        Args:
+            level: int, 0 for the gray image
+
+        Returns: np.array
+
+        '''
+        if level <= 0:
+            return self.gray()
+
+        def build():
+            upper = self.pyramid(level - 1)
+            h, w = upper.shape[0] // 2 * 2, upper.shape[1] // 2 * 2
+            upper = upper[:h, :w].astype(float)
+            lower = (upper[0::2, 0::2] + upper[1::2, 0::2] + upper[0::2, 1::2] + upper[1::2, 1::2]) / 4.
+            gray = self.gray()
+            if np.issubdtype(gray.dtype, np.integer):
+                lower = np.round(lower)
+            return lower.astype(gray.dtype)
+
+        return self.get(('pyramid', level), build)
+
+    @staticmethod
+    def __sizeOf(item):
+        return item.nbytes if isinstance(item, np.ndarray) else 0
@@ -19,6 +19,8 @@ from PyQt5.QtWidgets import QWidget, QToolBar, QAction, QTableWidget, QAbstractI
     QFileDialog, QMessageBox, QApplication, QGroupBox, QLabel, QLineEdit, QSpacerItem, QSizePolicy
 import numpy as np
 
+from RegionPropertyStore import RegionPropertyStore
+
 
 class LabelDataTable(QWidget):
     labelSelectedSignal = pyqtSignal([object], name='Table selected label changed')
@@ -108,24 +110,36 @@ class LabelDataTable(QWidget):
         self.mainLayout.addWidget(self.table)
         self.mainLayout.addLayout(self.toolbarHBox)
         self.setLayout(self.mainLayout)
-        self.labelData = []
+        self.labelIds = np.array([], dtype=int)
         self.resize(self.table.size().width(), self.size().height())
 
-    def setData(self, labelMask, realScale, cropPolygon: QPolygonF):
+    def setData(self, regionStore, realScale, cropPolygon: QPolygonF):
+        '''
+        set the regions shown in table.
+        Args:
+            regionStore: RegionPropertyStore of the label mask, or the label mask
+            realScale: mm per pixel
+            cropPolygon: crop polygon
+
+        Returns:
+
+        '''
         self.initUi()
-        from Image import imageLabelProperty
+        if isinstance(regionStore, np.ndarray):
+            regionStore = RegionPropertyStore(regionStore)
         self.realScale = realScale
-        self.labelData = imageLabelProperty(labelMask)
-        self.tableData = np.zeros([len(self.labelData), 6])
-        for i, row in enumerate(self.labelData):
-            self.tableData[i, 0:6] = [
-                row.centroid[0],
-                row.centroid[1],
-                row.area * realScale * realScale if realScale else 0,
-                row.perimeter * realScale if realScale else 0,
-                row.area,
-                row.perimeter
-            ]
+        stats = regionStore.statistics()
+        # label id of each row
+        self.labelIds = stats['label']
+        scale = realScale if realScale else 0
+        self.tableData = np.stack([
+            stats['centroid_row'],
+            stats['centroid_col'],
+            stats['area'] * scale * scale,
+            stats['perimeter'] * scale,
+            stats['area'],
+            stats['perimeter']
+        ], axis=1)
         # shapely
         from shapely.geometry import Polygon
         data = []
@@ -148,7 +162,7 @@ class LabelDataTable(QWidget):
         self.updateTable()
 
     def updateTable(self):
-        self.table.setRowCount(len(self.labelData) + 1)
+        self.table.setRowCount(len(self.labelIds) + 1)
         for r in range(self.tableData.shape[0]):
             for c in range(self.tableData.shape[1]):
                 item = QTableWidgetItem('%.2f' % self.tableData[r, c])
@@ -212,16 +226,17 @@ class LabelDataTable(QWidget):
                 ])
 
     def itemClickedAction(self, selected, deselected):
-        selectedRows = np.unique(np.array(list(map(lambda x: x.row() + 1, selected.indexes()))))
-        deselectedRows = np.unique(np.array(list(map(lambda x: x.row() + 1, deselected.indexes()))))
+        selectedRows = np.unique(np.array(list(map(lambda x: x.row(), selected.indexes())), dtype=int))
+        deselectedRows = np.unique(np.array(list(map(lambda x: x.row(), deselected.indexes())), dtype=int))
         print("selected add: %s; deselected: %s" % (selectedRows, deselectedRows))
-        self.selectedRows = np.unique(np.append(self.selectedRows, selectedRows)).astype(np.int)
-        self.selectedRows = np.setdiff1d(self.selectedRows, deselectedRows).astype(np.int)
-        selectedRows = self.selectedRows
+        self.selectedRows = np.unique(np.append(self.selectedRows, selectedRows)).astype(int)
+        self.selectedRows = np.setdiff1d(self.selectedRows, deselectedRows).astype(int)
+        # rows to label ids, the total row is not a label
+        selectedLabels = self.labelIds[self.selectedRows[self.selectedRows < len(self.labelIds)]]
         if not len(self.selectedRows):
-            selectedRows = np.arange(1, self.table.rowCount())
-        print("selected: %s" % selectedRows)
-        self.labelSelectedSignal.emit(selectedRows)
+            selectedLabels = self.labelIds
+        print("selected: %s" % selectedLabels)
+        self.labelSelectedSignal.emit(selectedLabels)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# -*-coding:utf-8 -*-
+
+# Reference: **********************************************
+# @Project   : code
+# @File    : ImagePyramid.py
+# @Time    : 2026/10/18 18:30
+# @License   : LGPL
+# @Author   : Dorad
+# @Email    : cug.xia@gmail.com
+# @Blog      : https://blog.cuger.cn
+
+import threading
+
+import numpy as np
+from PyQt5.QtCore import QObject, pyqtSignal, Qt, QSize
+from PyQt5.QtGui import QImage
+
+# the levels are halved until both sides are not greater than it
+PYRAMID_MIN_SIZE = 256
+
+
+class ImagePyramid(QObject):
+    '''
+    mipmap pyramid of an image for display, level k is the image downsampled by 2 ** k.
+    The levels are built in a background thread, levelReadySignal is emitted after each level is built.
+    '''
+    levelReadySignal = pyqtSignal([int], name='Pyramid level ready')
+
+    def __init__(self, image: QImage, background=True):
+        super(ImagePyramid, self).__init__()
+        # the image is shared with the caller, it's copied by Qt if the caller changes it
+        self.levels = [QImage(image)]
+        self.sizes = [image.size()]
+        while max(self.sizes[-1].width(), self.sizes[-1].height()) > PYRAMID_MIN_SIZE:
+            size = self.sizes[-1]
+            self.sizes.append(QSize(max(1, size.width() // 2), max(1, size.height() // 2)))
+        self.canceled = False
+        if background:
+            threading.Thread(target=self.__build, daemon=True).start()
+        else:
+            self.__build()
+
+    def cancel(self):
+        '''
+        stop building the levels, the built levels are kept.
+        '''
+        self.canceled = True
+
+    def levelCount(self):
+        return len(self.sizes)
+
+    def levelFor(self, scale):
+        '''
+        the coarsest level which still covers the scale, so it's not upsampled on screen.
+        Args:
+            scale: float, display scale of the image
+
+        Returns: int, level
+
+        '''
+        if scale >= 1:
+            return 0
+        return int(min(np.floor(np.log2(1. / scale)), self.levelCount() - 1))
+
+    def levelSize(self, level):
+        return self.sizes[level]
+
+    def image(self, level):
+        '''
+        image of the level, or the nearest finer level if it's not built yet.
+        Args:
+            level: int
+
+        Returns: (level, QImage)
+
+        '''
+        # the list is only appended by the builder
+        levels = self.levels
+        level = min(level, len(levels) - 1)
+        return level, levels[level]
+
+    def __build(self):
+        for level in range(1, self.levelCount()):
+            if self.canceled:
+                return
+            size = self.sizes[level]
+            image = self.levels[level - 1]
+            # the colors of an indexed image are not blended, so the levels keep its color table
+            mode = Qt.FastTransformation if image.format() == QImage.Format_Indexed8 else Qt.SmoothTransformation
+            self.levels.append(image.scaled(size, Qt.IgnoreAspectRatio, mode))
+            self.levelReadySignal.emit(level)
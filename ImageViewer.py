@@ -14,11 +14,14 @@ import os
 import sys
 
 import numpy as np
-from PyQt5.QtCore import QPointF, pyqtSignal, Qt, QPoint, QRect, QLineF
+from PyQt5.QtCore import QPointF, pyqtSignal, Qt, QPoint, QRect, QRectF, QLineF
 from PyQt5.QtGui import QIcon, QColor, QPalette, QPainter, QResizeEvent, QWheelEvent, QMouseEvent, QKeyEvent, QImage, \
     QPolygonF, QPainterPath
 from PyQt5.QtWidgets import QWidget, QApplication, QPushButton, QVBoxLayout, QHBoxLayout
 
+from ImagePyramid import ImagePyramid
+from TileCache import TileCache, TILE_SIZE
+
 
 class ImageViewer(QWidget):
     MousePosChangedSignal = pyqtSignal([QPointF], name='Mouse Pos Changed')
@@ -30,11 +33,15 @@ class ImageViewer(QWidget):
         # moniter = QApplication.desktop().size()
         moniter = QApplication.primaryScreen().size()
         self.resize(int(moniter.width() / 1.5), int(moniter.height() / 1.5))
+        self.pyramid = None
         self.initUi()
 
     def initUi(self):
         self.ImagePath = None  # 原始图片路径
         self.Image = None  # 图像
+        # the pyramid of the last image stops building and doesn't update the view any more
+        ImageViewer._releasePyramid(self.pyramid, self.pyramidLevelReadyAction)
+        self.pyramid = None  # 图像金字塔, for display
 
         self.cropPolygon = None  # 裁剪边框
 
@@ -45,6 +52,9 @@ class ImageViewer(QWidget):
         self.scale = 1  # 比例
         self.offset = QPointF(0, 0)  # 初始坐标
 
+        # rendered tiles of the layers, only the visible tiles are rendered, dropped by invalidateFrame
+        self.tileCache = TileCache()
+
         self.backgroundColor = QColor("#898989")
         # button
         self.zoomInBtn = QPushButton(QIcon('images/icons/zoom-in.png'), '')
@@ -79,14 +89,158 @@ class ImageViewer(QWidget):
         self.setAutoFillBackground(True)
         self.pt = QPainter()
         if self.Image:
-            renderImage = self.renderImage()
-            scaledImage = renderImage.scaled(int(renderImage.size().width() * self.scale),
-                                             int(renderImage.size().height() * self.scale))
             self.pt.begin(self)
-            self.pt.drawImage(self.offset, scaledImage)
+            self.drawTiles(self.pt)
             self.pt.end()
         self.draw_axis()
 
+    def drawTiles(self, painter: QPainter):
+        '''
+        draw the visible tiles of the layers, from the coarsest pyramid level covering the scale.
+        The tiles are rendered only if they are not in the tile cache, so the cost is bounded by the widget size.
+        '''
+        level = self.pyramid.levelFor(self.scale) if self.pyramid else 0
+        sx, sy = self._levelScale(level)
+        size = self._levelSize(level)
+        visible = QRectF(self._real2pix(QPointF(0, 0)), self._real2pix(QPointF(self.width(), self.height())))
+        tx0, ty0, tx1, ty1 = self._tileRange(level, visible)
+        layers = self.layers()
+        for ty in range(ty0, ty1):
+            for tx in range(tx0, tx1):
+                # the tile in the widget
+                target = QRectF(self._pix2real(QPointF(tx * TILE_SIZE / sx, ty * TILE_SIZE / sy)),
+                                self._pix2real(QPointF(min((tx + 1) * TILE_SIZE, size.width()) / sx,
+                                                       min((ty + 1) * TILE_SIZE, size.height()) / sy)))
+                for layer in layers:
+                    painter.drawImage(target, self.tile(layer, level, tx, ty))
+
+    def invalidateFrame(self, layer=None, rect: QRectF = None):
+        '''
+        drop the cached tiles, it should be called when the image, crop polygon, polygons or labels are changed.
+        Args:
+            layer: str, only the tiles of the layer, default all the layers
+            rect: QRectF, only the tiles over the rect of the image, default all the tiles
+
+        Returns:
+
+        '''
+        tiles = None if rect is None else lambda level: self._tileRange(level, rect)
+        self.tileCache.invalidate(layer=layer, tiles=tiles)
+        self.update()
+
+    def layers(self):
+        '''
+        layers drawn from bottom to top, the tiles of each layer are cached separately.
+        '''
+        return ['image']
+
+    def tile(self, layer, level, tx, ty):
+        key = (layer, level, tx, ty)
+        tile = self.tileCache.get(key)
+        if tile is None:
+            tile = self.renderTile(layer, level, tx, ty)
+            self.tileCache.put(key, tile)
+        return tile
+
+    def renderTile(self, layer, level, tx, ty):
+        '''
+        render a tile of the layer.
+        Args:
+            layer: str, layer in layers()
+            level: int, pyramid level
+            tx: int, column of the tile in the level
+            ty: int, row of the tile in the level
+
+        Returns: QImage, TILE_SIZE x TILE_SIZE, smaller at the right and bottom edges
+
+        '''
+        size = self._levelSize(level)
+        x, y = tx * TILE_SIZE, ty * TILE_SIZE
+        tile = QImage(min(TILE_SIZE, size.width() - x), min(TILE_SIZE, size.height() - y),
+                      QImage.Format_ARGB32_Premultiplied)
+        tile.fill(Qt.transparent)
+        sx, sy = self._levelScale(level)
+        painter = QPainter(tile)
+        painter.translate(-x, -y)
+        painter.scale(sx, sy)
+        self._drawLayer(painter, layer, level, QRectF(x / sx, y / sy, tile.width() / sx, tile.height() / sy))
+        painter.end()
+        return tile
+
+    def _levelSize(self, level=0):
+        return self.pyramid.levelSize(level) if self.pyramid else self.Image.size()
+
+    def _levelScale(self, level=0):
+        size = self._levelSize(level)
+        return size.width() / self.Image.width(), size.height() / self.Image.height()
+
+    def _tileRange(self, level, rect: QRectF):
+        '''
+        tiles of the level over the rect.
+        Args:
+            level: int, pyramid level
+            rect: QRectF, in the coordinates of the image
+
+        Returns: (tx0, ty0, tx1, ty1), max is exclusive
+
+        '''
+        sx, sy = self._levelScale(level)
+        size = self._levelSize(level)
+        return (max(0, int(np.floor(rect.left() * sx / TILE_SIZE))),
+                max(0, int(np.floor(rect.top() * sy / TILE_SIZE))),
+                min(int(np.ceil(size.width() / TILE_SIZE)), int(np.floor(rect.right() * sx / TILE_SIZE)) + 1),
+                min(int(np.ceil(size.height() / TILE_SIZE)), int(np.floor(rect.bottom() * sy / TILE_SIZE)) + 1))
+
+    def displayImage(self, level=0):
+        '''
+        image drawn under the crop polygon and overlays, at the pyramid level or the nearest finer level built.
+        '''
+        if self.pyramid is None:
+            return self.Image
+        return self.pyramid.image(level)[1]
+
+    def _renderTarget(self, level=0):
+        '''
+        transparent image with the size of the pyramid level, and the painter on it in the coordinates of the image.
+        Returns: (image, painter)
+
+        '''
+        size = self._levelSize(level)
+        paintedImage = QImage(size, QImage.Format_ARGB32)
+        paintedImage.fill(Qt.transparent)
+        painter = QPainter(paintedImage)
+        painter.scale(size.width() / self.Image.width(), size.height() / self.Image.height())
+        return paintedImage, painter
+
+    def _drawDisplayImage(self, painter: QPainter, level=0, rect: QRectF = None):
+        # the image of any level is drawn into the rect of the full image, only the part inside rect is drawn
+        image = self.displayImage(level)
+        if rect is None:
+            rect = QRectF(0, 0, self.Image.width(), self.Image.height())
+        sx, sy = image.width() / self.Image.width(), image.height() / self.Image.height()
+        painter.drawImage(rect, image, QRectF(rect.x() * sx, rect.y() * sy, rect.width() * sx, rect.height() * sy))
+
+    def _drawLayer(self, painter: QPainter, layer, level=0, rect: QRectF = None):
+        '''
+        draw the layer with the painter in the coordinates of the image.
+        Args:
+            painter: QPainter
+            layer: str, layer in layers()
+            level: int, pyramid level
+            rect: QRectF, part of the image to draw, default the full image
+
+        Returns:
+
+        '''
+        if layer == 'image':
+            painter.save()
+            if self.cropPolygon:
+                painterPath = QPainterPath()
+                painterPath.addPolygon(self.cropPolygon)
+                painter.setClipPath(painterPath, Qt.IntersectClip)
+            self._drawDisplayImage(painter, level, rect)
+            painter.restore()
+
     def draw_axis(self):
         # get size of widget
         width = self.size().width()
@@ -138,10 +292,10 @@ class ImageViewer(QWidget):
             print('移动量: %s, %s' % (posDiff.x(), posDiff.y()))
             # self.offset = self.offset + posDiff
             self.setViewPoint(offset=self.offset + posDiff)
+            self.update()
 
         self.mousePos = event.pos()
         self.MousePosChangedSignal.emit(self._real2pix(event.pos()))
-        self.update()
 
     def keyPressEvent(self, event: QKeyEvent) -> None:
         pass
@@ -163,12 +317,33 @@ class ImageViewer(QWidget):
             else:
                 self.ImagePath = imagePath
                 self.Image = QImage(self.ImagePath)
+            # the pyramid is built in background, the frame is rendered again when a level is ready
+            self.pyramid = ImagePyramid(self.Image)
+            self.pyramid.levelReadySignal.connect(self.pyramidLevelReadyAction)
             self.update()
 
         except Exception as e:
             raise e
         self.setImageCenter()
 
+    @staticmethod
+    def _releasePyramid(pyramid, slot):
+        '''
+        cancel the pyramid which is replaced, and disconnect it from the view.
+        '''
+        if pyramid is None:
+            return
+        pyramid.cancel()
+        try:
+            pyramid.levelReadySignal.disconnect(slot)
+        except TypeError:
+            pass
+
+    def pyramidLevelReadyAction(self, level):
+        # the tiles rendered from a finer level are rendered again
+        self.tileCache.invalidate(level=level)
+        self.update()
+
     def setImageCenter(self):
         if not self.Image:
             return None
@@ -215,22 +390,18 @@ class ImageViewer(QWidget):
 
     def setCropPolygon(self, polygon: QPolygonF):
         self.cropPolygon = polygon
-        self.update()
+        self.invalidateFrame()
 
-    def renderImage(self, remove_useless_background=False):
+    def renderImage(self, remove_useless_background=False, level=0):
         if not self.Image:
             return
-        paintedImage = QImage(self.Image.size(), QImage.Format_ARGB32)
-        paintedImage.fill(Qt.transparent)
-        painter = QPainter(paintedImage)
-        if self.cropPolygon:
-            painterPath = QPainterPath()
-            painterPath.addPolygon(self.cropPolygon)
-            painter.setClipPath(painterPath)
-        painter.drawImage(QPoint(), self.Image)
+        paintedImage, painter = self._renderTarget(level)
+        for layer in self.layers():
+            self._drawLayer(painter, layer, level)
+        transform = painter.transform()
         painter.end()
-        if remove_useless_background:
-            return paintedImage.copy(painterPath.boundingRect().toRect())
+        if remove_useless_background and self.cropPolygon:
+            return paintedImage.copy(transform.mapRect(self.cropPolygon.boundingRect()).toRect())
         else:
             return paintedImage
 
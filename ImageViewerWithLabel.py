@@ -10,20 +10,44 @@
 # @Email    : cug.xia@gmail.com
 # @Blog      : https://blog.cuger.cn
 
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 import numpy as np
-from PyQt5.QtCore import QPointF, Qt, QPoint
-from PyQt5.QtGui import QImage, QPolygonF, QPainter, QPainterPath
+from PyQt5.QtCore import QPointF, Qt, QRectF, pyqtSignal
+from PyQt5.QtGui import QImage, QPolygonF, QPainter, QPainterPath, qRgb
 from PyQt5.QtWidgets import QWidget, QApplication, QHBoxLayout
-from skimage import color, morphology
+from skimage import morphology
 
 from ImageViewer import ImageViewer
-from ColorCircle import ColorCircle
+from ImagePyramid import ImagePyramid
+from ColorCircle import ColorCircle, hsvColors
+from Image import qpolygon2narray
+from ImageCache import DerivedImageCache
+from RegionPropertyStore import RegionPropertyStore
+from ImageAnalysis import componentSizes, polygon2bboxMask, polygonAreaWindowLabel, rissPolygonsThreshold, \
+    rissPolygonsLabel, labelMergeWindow, labelDtype, compactLabels
+
+
+# color of the holes to be filled in the preview of removeSmallHoles
+HOLE_PREVIEW_COLOR = (128, 128, 128)
+# palette of the indexed overlay, white for background and hidden labels, gray for holes, then the label colors
+PALETTE_BACKGROUND = 0
+PALETTE_HOLE = 1
+PALETTE_LABELS = 2
+# the label colors are quantized into hue x value bins if they don't fit the palette
+PALETTE_HUE_BINS = 36
+PALETTE_VALUE_BINS = 7
 
 
 class ImageViewerWithLabel(ImageViewer):
+    # (window, lut) of the label edit: the label mask is relabeled with lut (None if it's not), then only the window
+    # (r0, r1, c0, c1) is changed, window is None if the whole label mask is changed
+    LabelMaskUpdatedSignal = pyqtSignal([object, object], name='Label Mask Updated')
+
     def __init__(self, remove_small_objects=64, remove_small_holes=64):
+        self.paintPyramid = None
         super(ImageViewerWithLabel, self).__init__()
         self.colorBar = ColorCircle(50)
         hBox = QHBoxLayout()
@@ -34,6 +58,10 @@ class ImageViewerWithLabel(ImageViewer):
         self.remove_small_holes = remove_small_holes
 
         self.showLabelList = np.array([], dtype=int)
+        # preview of remove small blocks or holes
+        self.regionFilter = None
+        # visibility of each label id, None for all labels are visible
+        self.labelVisible = None
 
     '''
     over load methods
@@ -44,26 +72,63 @@ class ImageViewerWithLabel(ImageViewer):
         label mask property
         '''
         ImageViewer.initUi(self)
-        self.labelMask = np.array([], dtype=int)
-        self.labelColors = []
+        # in the narrowest dtype fitting maxLabel
+        self.labelMask = np.array([], dtype=labelDtype(0))
+        self.maxLabel = 0
+        # region properties of labelMask, they're updated by the label operations
+        self.regionStore = RegionPropertyStore()
+        # palette of the overlay, palette index of each label id, and the version of regionStore they're computed from
+        self.labelPalette = None
+        self.labelPaletteIndex = None
+        self.labelPaletteVersion = None
+        self.derivedCache = DerivedImageCache()
+        self.cropMaskCache = None
         self.remove_small_objects = 64
         self.remove_small_holes = 64
         self.paintImage = None
+        # pyramid of paintImage, None if paintImage is the image or it's in preview
+        ImageViewer._releasePyramid(self.paintPyramid, self.pyramidLevelReadyAction)
+        self.paintPyramid = None
         self.update()
 
     def setImage(self, imagePath=None, image=None):
         # set image
         ImageViewer.setImage(self, imagePath, image)
         self.paintImage = self.Image
+        self.__updatePaintPyramid(build=False)
+        # gray image and other derived data of the image, they're built when they're used
+        self.derivedCache.setImage(None)
         # init mask property
-        self.labelMask = np.zeros([self.Image.height(), self.Image.width()], dtype=int)
-        self.labelColors = []
+        self.labelMask = np.zeros([self.Image.height(), self.Image.width()], dtype=labelDtype(0))
+        self.maxLabel = 0
+        self.regionStore.setLabelMask(self.labelMask)
         # update update widget
         self.update()
 
     def updatePaintImage(self):
         self.paintImage = self.imageWithLabel2Mask()
-        self.update()
+        self.__updatePaintPyramid()
+        self.invalidateFrame()
+
+    def hasLabels(self):
+        '''
+        True if there is any label, it's kept by regionStore so the label mask isn't scanned.
+        '''
+        return bool(self.regionStore.present.any())
+
+    def displayImage(self, level=0):
+        if self.paintImage is None or self.paintImage is self.Image:
+            return ImageViewer.displayImage(self, level)
+        if self.paintPyramid is None:
+            return self.paintImage
+        return self.paintPyramid.image(level)[1]
+
+    def __updatePaintPyramid(self, build=True):
+        ImageViewer._releasePyramid(self.paintPyramid, self.pyramidLevelReadyAction)
+        self.paintPyramid = None
+        if build and self.paintImage is not None and self.paintImage is not self.Image:
+            self.paintPyramid = ImagePyramid(self.paintImage)
+            self.paintPyramid.levelReadySignal.connect(self.pyramidLevelReadyAction)
 
     # def paintEvent(self, event):
     #     if self.mouseLeftButtonDown:
@@ -88,233 +153,416 @@ class ImageViewerWithLabel(ImageViewer):
     label mask operation methods
     '''
 
-    def addLabelMask(self, labelMask):
+    def addLabelMask(self, labelMask, offset=(0, 0), update=True):
         '''
         append label mask to exist mask.
         Args:
             labelMask: new label mask
+            offset: (row, col) of the new label mask in the exist mask
+            update: bool, update the view after merged
 
         Returns:
 
         '''
         assert type(labelMask) == np.ndarray
-        self.labelMask = ImageViewerWithLabel.__imageLabelMerge(self.labelMask, labelMask)
+        # remove label out of cropPolygon
+        labelMask = self.__applyCropPolygon(labelMask, offset)
+        # only the window of new label mask is labeled
+        self.labelMask, self.maxLabel, lut = labelMergeWindow(self.labelMask, labelMask, offset, self.maxLabel,
+                                                              returnLut=True)
+        # the labels are changed inside the window (with 1 pixel margin), and relabeled if lut is not None
+        r0, c0 = offset
+        window = (r0 - 1, r0 + labelMask.shape[0] + 1, c0 - 1, c0 + labelMask.shape[1] + 1)
+        self.regionStore.update(self.labelMask, window=window, lut=lut)
+        self.LabelMaskUpdatedSignal.emit(window, lut)
         # update view
+        if update:
+            self.updatePaintImage()
+
+    def setLabelMask(self, labelMask):
+        '''
+        replace the label mask, such as the label image of project. It's cut or padded to the size of the image.
+        Args:
+            labelMask: label mask, empty if there is no label
+
+        Returns:
+
+        '''
+        assert type(labelMask) == np.ndarray
+        height, width = self.labelMask.shape
+        mask = np.zeros([height, width], dtype=labelMask.dtype if labelMask.ndim == 2 else labelDtype(0))
+        if labelMask.ndim == 2:
+            h, w = min(height, labelMask.shape[0]), min(width, labelMask.shape[1])
+            mask[:h, :w] = labelMask[:h, :w]
         # remove label out of cropPolygon
-        mask = ImageViewerWithLabel.__QPolygon2Mask(self.labelMask.shape, self.cropPolygon)
-        self.labelMask[mask == 0] = 0
+        mask = self.__applyCropPolygon(mask)
+        self.maxLabel = int(mask.max(initial=0))
+        self.labelMask = compactLabels(mask, self.maxLabel)
+        self.regionStore.setLabelMask(self.labelMask)
+        self.LabelMaskUpdatedSignal.emit(None, None)
         self.updatePaintImage()
 
+    def setCropPolygon(self, polygon: QPolygonF):
+        ImageViewer.setCropPolygon(self, polygon)
+        self.cropMaskCache = None
+        # remove exist label out of cropPolygon
+        if self.labelMask.any():
+            self.labelMask = self.__applyCropPolygon(self.labelMask)
+            self.regionStore.update(self.labelMask)
+            self.LabelMaskUpdatedSignal.emit(None, None)
+            self.updatePaintImage()
+
+    def __cropMask(self):
+        '''
+        binary mask of cropPolygon inside its bounding box, cached until the cropPolygon is changed.
+
+        Returns: (mask, (r0, c0)), None if there is no cropPolygon
+
+        '''
+        if not self.cropPolygon:
+            return None
+        vertices = qpolygon2narray(self.cropPolygon)
+        # cropPolygon may be assigned directly, so the vertices are compared
+        if self.cropMaskCache is None or not np.array_equal(self.cropMaskCache[0], vertices):
+            self.cropMaskCache = (vertices, polygon2bboxMask(self.labelMask.shape, vertices))
+        return self.cropMaskCache[1]
+
+    def __applyCropPolygon(self, labelMask, offset=(0, 0)):
+        '''
+        remove the labels out of cropPolygon.
+        Args:
+            labelMask: label mask, it's changed in place
+            offset: (row, col) of the label mask in the image
+
+        Returns: label mask
+
+        '''
+        cropMask = self.__cropMask()
+        if cropMask is None:
+            return labelMask
+        cropMask, (cr, cc) = cropMask
+        # overlap of the label mask and bounding box of cropPolygon
+        r0, c0 = max(cr, offset[0]), max(cc, offset[1])
+        r1 = min(cr + cropMask.shape[0], offset[0] + labelMask.shape[0])
+        c1 = min(cc + cropMask.shape[1], offset[1] + labelMask.shape[1])
+        inside = np.zeros(labelMask.shape, dtype=bool)
+        if r0 < r1 and c0 < c1:
+            inside[r0 - offset[0]:r1 - offset[0], c0 - offset[1]:c1 - offset[1]] = cropMask[r0 - cr:r1 - cr,
+                                                                                            c0 - cc:c1 - cc]
+        labelMask[~inside] = 0
+        return labelMask
+
     def imageWithLabel2Mask(self):
-        labelMaskShown = np.zeros(self.labelMask.shape, dtype=int)
-        if len(self.showLabelList) > 0:
-            for label in self.showLabelList:
-                labelMaskShown[self.labelMask == label] = label
-        else:
-            labelMaskShown = self.labelMask
-
-        # from skimage import color
-        # labelImg = color.label2rgb(labelMaskShown, image=ImageViewerWithLabel.__qimage2narray(self.Image), bg_label=0,
-        #                            alpha=0.25)
-
-        from Image import imageLabelProperty
-        self.labelData = imageLabelProperty(labelMaskShown)
-        labelImg = ImageViewerWithLabel.__qimage2narray(self.Image)
-        # labelImg = labelImg.astype(np.uint8)
-        labelImg = np.ones(labelImg.shape, dtype=int) * 255
-        for lData in self.labelData:
-            if lData.major_axis_length:
-                r = 1 - lData.minor_axis_length / lData.major_axis_length
-            else:
-                r = 0
-            lColor = self.colorBar.getColorByAngleAndRP(
-                lData.orientation + np.pi, r)
-            labelImg[lData.coords[:, 0], lData.coords[:, 1], 0] = lColor.red()
-            labelImg[lData.coords[:, 0], lData.coords[:, 1], 1] = lColor.green()
-            labelImg[lData.coords[:, 0], lData.coords[:, 1], 2] = lColor.blue()
-        return ImageViewerWithLabel.__narray2qimage(labelImg)
-
-    def renderImage(self, remove_useless_background=False):
-        if not self.Image:
-            return
-        paintedImage = QImage(self.Image.size(), QImage.Format_ARGB32)
-        paintedImage.fill(Qt.transparent)
-        painter = QPainter(paintedImage)
-        if self.cropPolygon:
+        '''
+        the overlay as an indexed image, the palette index of each pixel is looked up from its label id at once.
+        Returns: QImage, Format_Indexed8
+
+        '''
+        paletteIndex = self.__visiblePaletteIndex()
+        image = QImage(self.labelMask.shape[1], self.labelMask.shape[0], QImage.Format_Indexed8)
+        image.setColorTable([qRgb(*[int(c) for c in color]) for color in self.labelPalette])
+        np.take(paletteIndex, self.labelMask, out=ImageViewerWithLabel.__qimage2indices(image), mode='clip')
+        return image
+
+    def __visiblePaletteIndex(self):
+        '''
+        palette index of each label id, the hidden labels are background.
+        Returns: np.array, (max label + 1,), uint8
+
+        '''
+        if self.labelPaletteVersion != self.regionStore.version:
+            self.labelPalette, self.labelPaletteIndex = self.__labelPalette()
+            self.labelPaletteVersion = self.regionStore.version
+        visible = self.__labelVisibility(self.labelPaletteIndex.size)
+        return np.where(visible, self.labelPaletteIndex, PALETTE_BACKGROUND).astype(np.uint8)
+
+    def __labelPalette(self):
+        '''
+        palette of the overlay and the palette index of each label id, the color of a label is from the orientation
+        and elongation of the region. The colors are quantized into hue x value bins if there are too many of them.
+        Returns: (palette, paletteIndex), np.array (N <= 256, 3) uint8, np.array (max label + 1,) uint8
+
+        '''
+        stats = self.regionStore.statistics()
+        paletteIndex = np.full(self.regionStore.present.size, PALETTE_BACKGROUND, dtype=np.uint8)
+        palette = [(255, 255, 255), HOLE_PREVIEW_COLOR]
+        if len(stats['label']):
+            major = stats['major_axis_length']
+            angle = stats['orientation'] + np.pi
+            r = np.where(major > 0, 1 - stats['minor_axis_length'] / np.where(major > 0, major, 1), 0)
+            colors, index = np.unique(hsvColors(angle, r)[:, :3], axis=0, return_inverse=True)
+            if colors.shape[0] > 256 - PALETTE_LABELS:
+                # color of the center of each bin
+                hueBin = np.floor(angle / (2 * np.pi) * PALETTE_HUE_BINS).astype(int) % PALETTE_HUE_BINS
+                valueBin = np.clip(np.floor(r * PALETTE_VALUE_BINS).astype(int), 0, PALETTE_VALUE_BINS - 1)
+                hues, values = np.meshgrid((np.arange(PALETTE_HUE_BINS) + 0.5) / PALETTE_HUE_BINS * 2 * np.pi,
+                                           (np.arange(PALETTE_VALUE_BINS) + 0.5) / PALETTE_VALUE_BINS, indexing='ij')
+                colors = hsvColors(hues.ravel(), values.ravel())[:, :3]
+                index = hueBin * PALETTE_VALUE_BINS + valueBin
+            palette += [tuple(color) for color in colors]
+            paletteIndex[stats['label']] = PALETTE_LABELS + index.reshape(-1)
+        return np.array(palette, dtype=np.uint8), paletteIndex
+
+    def __labelVisibility(self, size):
+        visible = np.ones(size, dtype=bool)
+        if self.labelVisible is not None:
+            visible[:] = False
+            n = min(size, len(self.labelVisible))
+            visible[:n] = self.labelVisible[:n]
+        return visible
+
+    def _drawLayer(self, painter: QPainter, layer, level=0, rect: QRectF = None):
+        # the label overlay is drawn instead of the image, inside the crop polygon
+        if layer == 'image' and self.cropPolygon:
+            painter.save()
             painterPath = QPainterPath()
             painterPath.addPolygon(self.cropPolygon)
-            painter.setClipPath(painterPath)
+            painter.setClipPath(painterPath, Qt.IntersectClip)
             painter.drawPolygon(self.cropPolygon)
-        painter.drawImage(QPoint(), self.paintImage)
-        painter.end()
-        if remove_useless_background and self.cropPolygon:
-            return paintedImage.copy(painterPath.boundingRect().toRect())
-        else:
-            return paintedImage
+            painter.restore()
+        ImageViewer._drawLayer(self, painter, layer, level, rect)
 
     '''
     user operation
     '''
 
     def addPolygonArea(self, polygon: QPolygonF):
-        # convert QImage into numpy array
-        imgArr = ImageViewerWithLabel.__qimage2narray(self.Image)
-        # convert image into gray mode if it's rgb mode.
-        gray = color.rgb2gray(imgArr)
         # check if the polygon is inside the cropPolygon
         polygon = polygon.intersected(self.cropPolygon)
-        # polygon to binary mask
-        mask = ImageViewerWithLabel.__QPolygon2Mask(gray.shape, polygon)
-        # __otsuWithMask2bw
-        bw = ImageViewerWithLabel.__otsuWithMask2bw(gray, mask)
-        # remove small objects
-        # morphology.remove_small_objects(bw, min_size=self.remove_small_objects, connectivity=2, in_place=True)
-        # morphology.remove_small_holes(bw, area_threshold=self.remove_small_holes, connectivity=2, in_place=True)
-        # binary image to label image
-        label = morphology.label(bw, connectivity=2)
-        self.addLabelMask(label)
+        # otsu inside the bounding box of polygon, binary image to label image
+        label, offset = polygonAreaWindowLabel(self.__gray(), qpolygon2narray(polygon))
+        self.addLabelMask(label, offset)
+
+    def addPolygonAreas(self, polygons, progress=None, workers=None):
+        '''
+        add polygon areas with a thread pool, the results are merged as they complete.
+        Args:
+            polygons: list of QPolygonF
+            progress: QProgressDialog, optional, its value is the number of merged polygons,
+                the outstanding polygons are dropped once it's canceled, it's closed when it's finished
+            workers: int, number of threads, default is the number of cpu
+
+        Returns: bool, False if it's canceled. The error of a polygon is raised after the outstanding polygons are
+            dropped, and the merged polygons are kept
+
+        '''
+        gray = self.__gray()
+        # Qt objects are only used in GUI thread
+        polygons = [qpolygon2narray(polygon.intersected(self.cropPolygon)) for polygon in polygons]
+        executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+        pending = {executor.submit(polygonAreaWindowLabel, gray, polygon) for polygon in polygons}
+        finished = 0
+        canceled = False
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+                for future in done:
+                    label, offset = future.result()
+                    self.addLabelMask(label, offset, update=False)
+                    finished += 1
+                if progress is not None:
+                    progress.setValue(finished)
+                    QApplication.processEvents()
+                    if progress.wasCanceled():
+                        canceled = True
+                        break
+        finally:
+            # the outstanding polygons are dropped if it's canceled or failed, the running ones are finished in
+            # background and dropped
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+            if progress is not None:
+                progress.close()
+            self.updatePaintImage()
+        return not canceled
 
     def deletePolygonArea(self, polygon: QPolygonF):
-        # polygon to binary mask
-        mask = ImageViewerWithLabel.__QPolygon2Mask(self.labelMask.shape, polygon)
+        # polygon to binary mask inside its bounding box
+        mask, (r0, c0) = polygon2bboxMask(self.labelMask.shape, qpolygon2narray(polygon))
         # remove mask area
-        self.labelMask[mask > 0] = 0
+        self.labelMask[r0:r0 + mask.shape[0], c0:c0 + mask.shape[1]][mask] = 0
+        window = (r0, r0 + mask.shape[0], c0, c0 + mask.shape[1])
+        self.regionStore.update(window=window)
+        self.LabelMaskUpdatedSignal.emit(window, None)
         self.updatePaintImage()
 
     # add Riss Polygons
     def addRissPolygons(self, polygons):
-        # convert QImage into numpy array
-        imgArr = ImageViewerWithLabel.__qimage2narray(self.Image)
-        # convert image into gray mode if it's rgb mode.
-        gray = color.rgb2gray(imgArr)
-        maskedGrayImage = np.ma.masked_array(gray, ImageViewerWithLabel.__QPolygon2Mask(gray.shape, self.cropPolygon))
-        # polygon to binary mask
-        mask = np.empty(gray.shape)
-        for polygon in polygons:
-            mask += ImageViewerWithLabel.__QPolygon2Mask(gray.shape, polygon)
-        mask = mask > 0
-        # 获得像素值
-        pixels = gray[mask > 0]
-        # 计算 ROIs 中的灰度直方图
-        # hist, bin_edges = np.histogram(pixels.flatten(), bins=255, range=(-0.5, 255.5))
-        # 估算正态分布
-        mu = np.mean(pixels)  # 计算均值
-        sigma = np.std(pixels)
-        # 计算 m+1.95o, 得到阈值
-        threshold = mu + 1.96 * sigma
-        # 二值化
-        binary = maskedGrayImage > threshold
-        label = morphology.label(binary, connectivity=2)
-        print("RISS阈值: %f, 破坏像素数量： %d" % (threshold * 255, np.sum(binary > 0)))
+        gray = self.__gray()
+        polygons = [qpolygon2narray(polygon) for polygon in polygons]
+        # 计算 m+1.96o, 得到阈值
+        threshold = rissPolygonsThreshold(gray, polygons)
+        label = rissPolygonsLabel(gray, polygons, threshold=threshold)
+        print("RISS阈值: %f, 破坏像素数量： %d" % (threshold, np.sum(label > 0)))
         self.addLabelMask(label)
 
     def setShowLabelList(self, showLabelList):
         self.showLabelList = showLabelList
+        labels = np.asarray(showLabelList, dtype=int)
+        if len(labels):
+            self.labelVisible = np.zeros(labels.max() + 1, dtype=bool)
+            self.labelVisible[labels] = True
+        else:
+            self.labelVisible = None
+        # only the visibility is changed, the color table is reused
         self.updatePaintImage()
 
     def deleteLabels(self, labels):
         assert type(labels) == list
-        for label in labels:
-            # delete label
-            self.labelMask[self.labelMask == label] = 0
-            # update label property
+        # delete labels with one lookup table, the other labels keep their id
+        lut = np.arange(max([self.maxLabel] + labels) + 1)
+        lut[labels] = 0
+        self.labelMask = lut.astype(self.labelMask.dtype)[self.labelMask]
+        # update label property
+        self.regionStore.update(self.labelMask, lut=lut)
+        # only relabeled, the window is empty
+        self.LabelMaskUpdatedSignal.emit((0, 0, 0, 0), lut)
         self.updatePaintImage()
 
     def deleteAllLabels(self):
         self.paintImage = self.Image
-        self.labelMask = np.zeros([self.Image.height(), self.Image.width()], dtype=int)
+        self.labelMask = np.zeros([self.Image.height(), self.Image.width()], dtype=labelDtype(0))
+        self.maxLabel = 0
+        self.regionStore.setLabelMask(self.labelMask)
+        self.LabelMaskUpdatedSignal.emit(None, None)
         self.showLabelList = []
+        self.labelVisible = None
         self.updatePaintImage()
 
     def removeSmallBlocks(self, remove_small_blocks=64):
-        bw = morphology.remove_small_objects(self.labelMask > 0, min_size=remove_small_blocks, connectivity=2)
-        self.labelMask = morphology.label(bw, connectivity=2)
+        self.__applyRegionFilter(self.__regionFilterSizes(holes=False), remove_small_blocks)
         self.updatePaintImage()
 
     def removeSmallHoles(self, remove_small_holes=64):
-        bw = morphology.remove_small_holes(self.labelMask > 0, area_threshold=remove_small_holes, connectivity=2)
-        self.labelMask = morphology.label(bw, connectivity=2)
+        self.__applyRegionFilter(self.__regionFilterSizes(holes=True), remove_small_holes)
         self.updatePaintImage()
 
     '''
-    image operation
+    preview of remove small blocks or holes
     '''
 
-    @staticmethod
-    def __narray2qimage(img):
-        if img.dtype == 'float64':
-            img = np.array(img * 255).astype(np.int)
-        from qimage2ndarray import array2qimage
-        return array2qimage(img)
-        # if img.shape[2] > 1:  # RGB image
-        #     return QImage(np.require(img, np.uint8, 'C'), img.shape[1], img.shape[0], img.shape[1] * 3,
-        #                   QImage.Format_RGB888)
-        # else:  # gray image
-        #     return QImage(np.require(img, np.uint8, 'C'), img.shape[1], img.shape[0], img.shape[1],
-        #                   QImage.Format_Grayscale8)
+    def beginRegionFilter(self, holes=False):
+        '''
+        start the preview of removeSmallBlocks (or removeSmallHoles), the sizes of blocks (holes) are computed once,
+        and each threshold only flips the pixels of the blocks whose size is between the old and new thresholds.
+        Args:
+            holes: bool, preview of removeSmallHoles
 
-    @staticmethod
-    def __qimage2narray(qimage):
-        from qimage2ndarray import rgb_view
-        return rgb_view(qimage=qimage)
+        Returns: np.array, sizes of the blocks (holes)
 
-    @staticmethod
-    def __otsuWithMask2bw(img: np.array, mask: np.array):
         '''
-        convert image with mask to binary image using otsu method.
+        regionFilter = self.__regionFilterSizes(holes)
+        # pixels of the blocks (holes) sorted by the size of their block
+        pixels = np.flatnonzero(regionFilter['component'])
+        pixelSizes = regionFilter['sizes'][regionFilter['component'].ravel()[pixels]]
+        order = np.argsort(pixelSizes, kind='stable')
+        regionFilter['pixels'] = pixels[order]
+        regionFilter['pixelSizes'] = pixelSizes[order]
+        regionFilter['threshold'] = 0
+        regionFilter['paletteIndex'] = self.__visiblePaletteIndex()
+        self.regionFilter = regionFilter
+        self.paintImage = self.imageWithLabel2Mask()
+        # paintImage is changed in place by the preview, it's drawn without pyramid
+        self.__updatePaintPyramid(build=False)
+        self.invalidateFrame()
+        return regionFilter['sizes'][1:]
+
+    def previewRegionFilter(self, threshold):
+        '''
+        preview the blocks (holes) removed (filled) with threshold, the blocks are hidden and the holes are gray.
         Args:
-            img: np.array, two dimensions, gray image
-            mask: np.array, two dimensions, binary image
+            threshold: float, the blocks (holes) smaller than threshold are removed (filled), pixels
 
         Returns:
 
         '''
-        # calculate the threshold for the image under mask
-        masked = np.ma.masked_array(img, mask == 0)
-        from skimage import filters
-        otsu = filters.threshold_otsu(masked.compressed())
-        print('OTSU: %s' % otsu)
-        # convert gray image under mask into binary image
-        # maskedImage = np.reshape(masked, img.shape)
-        maskedImage = masked.filled(fill_value=0)
-        bw = maskedImage >= otsu
-        return bw
+        regionFilter = self.regionFilter
+        if regionFilter is None or threshold == regionFilter['threshold']:
+            return
+        lo, hi = sorted([regionFilter['threshold'], threshold])
+        i0, i1 = np.searchsorted(regionFilter['pixelSizes'], [lo, hi], side='left')
+        rows, cols = np.divmod(regionFilter['pixels'][i0:i1], self.labelMask.shape[1])
+        removed = threshold > regionFilter['threshold']
+        view = ImageViewerWithLabel.__qimage2indices(self.paintImage)
+        if regionFilter['holes']:
+            view[rows, cols] = PALETTE_HOLE if removed else PALETTE_BACKGROUND
+        elif removed:
+            view[rows, cols] = PALETTE_BACKGROUND
+        else:
+            view[rows, cols] = regionFilter['paletteIndex'][self.labelMask[rows, cols]]
+        regionFilter['threshold'] = threshold
+        # only the tiles over the flipped pixels are rendered again
+        if rows.size:
+            self.invalidateFrame(rect=QRectF(cols.min(), rows.min(), cols.max() - cols.min() + 1,
+                                             rows.max() - rows.min() + 1))
+
+    def endRegionFilter(self, threshold=None):
+        '''
+        end the preview, the blocks (holes) are removed (filled) if threshold is given.
+        Args:
+            threshold: float, pixels, None to cancel
 
-    @staticmethod
-    def __QPolygon2Mask(imageShape: np.array, polygon: QPolygonF):
-        poa = np.empty([len(polygon), 2])
-        for i, p in enumerate(polygon):
-            poa[i, :] = [p.x(), p.y()]
-            # poa = np.append(poa, [p.x(), p.y()])
-        from skimage import draw
-        mask = draw.polygon2mask([imageShape[1], imageShape[0]], poa)
-        return mask.transpose()
+        Returns:
 
-    @staticmethod
-    def __imageLabelMerge(oldLabel, newLabel=None):
         '''
-        merge labels with no repeat label id.
+        regionFilter, self.regionFilter = self.regionFilter, None
+        if regionFilter is not None and threshold is not None:
+            self.__applyRegionFilter(regionFilter, threshold)
+        self.updatePaintImage()
+
+    def __regionFilterSizes(self, holes):
+        bw = self.labelMask > 0
+        component, sizes = componentSizes(~bw if holes else bw, connectivity=2)
+        return {'holes': holes, 'component': component, 'sizes': sizes}
+
+    def __applyRegionFilter(self, regionFilter, threshold):
+        '''
+        remove the small blocks or fill the small holes, and relabel the label mask.
         Args:
-            oldLabel:
-            newLabel:
+            regionFilter: dict, from __regionFilterSizes
+            threshold: float, the blocks (holes) smaller than threshold are removed (filled), pixels
+
+        Returns:
 
-        Returns: merged label without repeat label id
         '''
+        small = regionFilter['sizes'] < threshold
+        small[0] = False
+        if regionFilter['holes']:
+            bw = (self.labelMask > 0) | small[regionFilter['component']]
+        else:
+            bw = (regionFilter['component'] > 0) & ~small[regionFilter['component']]
+        labelMask, self.maxLabel = morphology.label(bw, connectivity=2, return_num=True)
+        labelMask = compactLabels(labelMask, self.maxLabel)
+        self.regionStore.relabel(labelMask)
+        self.labelMask = labelMask
+        self.LabelMaskUpdatedSignal.emit(None, None)
 
-        if not newLabel.any():
-            return oldLabel
+    '''
+    image operation
+    '''
 
-        assert type(oldLabel) == np.ndarray
-        assert type(newLabel) == np.ndarray
+    def __gray(self):
+        # gray image of the image, it's converted into array at the first use
+        if self.derivedCache.image is None:
+            self.derivedCache.setImage(ImageViewerWithLabel.__qimage2narray(self.Image))
+        return self.derivedCache.gray()
 
-        if oldLabel.shape != newLabel.shape:
-            newLabel = np.pad(newLabel,
-                              ((0, oldLabel.shape[0] - newLabel.shape[0]), (0, oldLabel.shape[1] - newLabel.shape[1])),
-                              'constant', constant_values=0)
+    @staticmethod
+    def __qimage2narray(qimage):
+        from qimage2ndarray import rgb_view, byte_view
+        if qimage.format() == QImage.Format_Grayscale8:
+            return byte_view(qimage)[:, :, 0]
+        # rgb_view only accepts 32-bit images, the others (indexed, 24-bit, 16-bit, ...) are converted at first
+        if qimage.format() not in (QImage.Format_RGB32, QImage.Format_ARGB32, QImage.Format_ARGB32_Premultiplied):
+            qimage = qimage.convertToFormat(QImage.Format_RGB32)
+        return rgb_view(qimage=qimage)
 
-        from skimage import measure
-        relabeled = measure.label(oldLabel + newLabel > 0, connectivity=2, background=0)
-        return relabeled
+    @staticmethod
+    def __qimage2indices(qimage):
+        # palette indices of an indexed image, shared with the image
+        from qimage2ndarray import raw_view
+        return raw_view(qimage)
 
 
 if __name__ == '__main__':
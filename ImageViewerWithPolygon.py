@@ -12,11 +12,12 @@
 
 from uuid import uuid4
 
-from PyQt5.QtCore import QPointF, pyqtSignal, QLineF, Qt, QPoint
-from PyQt5.QtGui import QIcon, QPolygonF, QColor, QMouseEvent, QKeyEvent, QImage, QPainter, QPainterPath, QPen
+from PyQt5.QtCore import QPointF, pyqtSignal, QLineF, Qt, QRectF
+from PyQt5.QtGui import QIcon, QPolygonF, QColor, QMouseEvent, QKeyEvent, QPainter, QPainterPath, QPen
 from PyQt5.QtWidgets import QWidget, QPushButton
 
 from ImageViewer import ImageViewer
+from SpatialIndex import SpatialIndex
 
 
 class ImageViewerWithPolygon(ImageViewer):
@@ -44,6 +45,7 @@ class ImageViewerWithPolygon(ImageViewer):
         ImageViewer.initUi(self)
         # self.polygonDrawing = False
         self.polygonList = []  # {geo:'',results:'', type:'', selected:False}
+        self.polygonIndex = SpatialIndex()  # bounding boxes of polygonList, by uid
         # self.tmpPolygon = QPolygonF()
         self.tmpDrawPoints = []
         self.drawModel = 'polygon'  # 0. scaleLine, 1. cropPolygon, 2. polygon
@@ -79,16 +81,22 @@ class ImageViewerWithPolygon(ImageViewer):
                 # check draw type and points length.
                 self.__draw(event.pos())
             else:
-                # check if something is selected
-                for idx, polygon in enumerate(self.polygonList):
-                    p = polygon['geo']
-                    if p.containsPoint(self._real2pix(event.pos()), Qt.OddEvenFill):
-                        self.polygonList[idx]['selected'] = ~self.polygonList[idx]['selected']
-                        self.update()
+                # check if something is selected, only the polygons around the point are tested
+                pos = self._real2pix(event.pos())
+                for polygon in self.polygonIndex.queryPoint(pos.x(), pos.y()):
+                    if polygon['geo'].containsPoint(pos, Qt.OddEvenFill):
+                        polygon['selected'] = ~polygon['selected']
+                        self.invalidateFrame('polygon', self.__polygonRect(polygon))
         elif event.button() == Qt.RightButton and self.drawing:
             # check if it's confirm of cancel
             self.__drawExit()
 
+    def mouseMoveEvent(self, event: QMouseEvent) -> None:
+        ImageViewer.mouseMoveEvent(self, event)
+        # the polygon in drawing follows the mouse
+        if self.drawing:
+            self.update()
+
     def keyPressEvent(self, event: QKeyEvent) -> None:
         if self.drawing:
             if (event.key() == Qt.Key_Return or event.key() == Qt.Key_Enter) and len(self.tmpPolygon) > 2:
@@ -142,10 +150,16 @@ class ImageViewerWithPolygon(ImageViewer):
             polygon['selected'] = False
         polygon['uid'] = str(uuid4())
         self.polygonList.append(polygon)
+        self.polygonIndex.insert(polygon['uid'], self.__polygonRect(polygon), polygon)
         self.PolygonListUpdatedSignal.emit('add', polygon)
-        self.update()
+        self.invalidateFrame('polygon', self.__polygonRect(polygon))
         return True
 
+    @staticmethod
+    def __polygonRect(polygon):
+        # bounding box of the polygon with its edge
+        return polygon['geo'].boundingRect().adjusted(-5, -5, 5, 5)
+
     def __delLastPointInTmpPolygon(self):
         if len(self.tmpDrawPoints) > 0:
             del self.tmpDrawPoints[len(self.tmpDrawPoints) - 1]
@@ -162,33 +176,50 @@ class ImageViewerWithPolygon(ImageViewer):
         self.drawing = True
         self.tmpDrawPoints = []
 
+    def setPolygonList(self, polygonList):
+        '''
+        replace the polygons, such as the polygons of a project, the spatial index is built again.
+        Args:
+            polygonList: list of dict, {geo: QPolygonF, selected: bool, uid: str}
+
+        Returns:
+
+        '''
+        self.polygonList = list(polygonList)
+        self.polygonIndex.clear()
+        for polygon in self.polygonList:
+            if 'selected' not in polygon.keys():
+                polygon['selected'] = False
+            if 'uid' not in polygon.keys():
+                polygon['uid'] = str(uuid4())
+            self.polygonIndex.insert(polygon['uid'], self.__polygonRect(polygon), polygon)
+        self.invalidateFrame('polygon')
+
     def selectPolygon(self, uid):
-        for idx, polygon in enumerate(self.polygonList):
-            if polygon['uid'] == uid:
-                self.polygonList[idx]['selected'] = True
-                self.PolygonListUpdatedSignal.emit('selected', polygon)
-                break
-        self.update()
+        polygon = self.polygonIndex.get(uid)
+        if polygon is not None:
+            polygon['selected'] = True
+            self.PolygonListUpdatedSignal.emit('selected', polygon)
+            self.invalidateFrame('polygon', self.__polygonRect(polygon))
 
     def unselectPolygon(self, uid):
-        for idx, polygon in enumerate(self.polygonList):
-            if polygon['uid'] == uid:
-                self.polygonList[idx]['selected'] = False
-                self.PolygonListUpdatedSignal.emit('unselected', polygon)
-                break
-        self.update()
+        polygon = self.polygonIndex.get(uid)
+        if polygon is not None:
+            polygon['selected'] = False
+            self.PolygonListUpdatedSignal.emit('unselected', polygon)
+            self.invalidateFrame('polygon', self.__polygonRect(polygon))
 
     def selectAllPolygon(self):
         for idx, polygon in enumerate(self.polygonList):
             self.polygonList[idx]['selected'] = True
             self.PolygonListUpdatedSignal.emit('selected', polygon)
-        self.update()
+        self.invalidateFrame('polygon')
 
     def unselectAllPolygon(self):
         for idx, polygon in enumerate(self.polygonList):
             self.polygonList[idx]['selected'] = False
             self.PolygonListUpdatedSignal.emit('unselected', polygon)
-        self.update()
+        self.invalidateFrame('polygon')
 
     def delPolygonSelected(self):
         unselectedPolygonList = []
@@ -196,34 +227,35 @@ class ImageViewerWithPolygon(ImageViewer):
             if not polygon['selected']:
                 unselectedPolygonList.append(polygon)
             else:
+                self.polygonIndex.remove(polygon['uid'])
                 self.PolygonListUpdatedSignal.emit('delete', polygon)
         self.polygonList = unselectedPolygonList
-        self.update()
+        self.invalidateFrame('polygon')
 
-    def renderImage(self, remove_useless_background=False):
-        if not self.Image:
+    def layers(self):
+        # the polygons are drawn in their own tiles, so selecting a polygon doesn't render the image again
+        return ImageViewer.layers(self) + ['polygon']
+
+    def _drawLayer(self, painter: QPainter, layer, level=0, rect: QRectF = None):
+        if layer != 'polygon':
+            ImageViewer._drawLayer(self, painter, layer, level, rect)
             return
-        paintedImage = QImage(self.Image.size(), QImage.Format_ARGB32)
-        paintedImage.fill(Qt.transparent)
-        painter = QPainter(paintedImage)
+        painter.save()
         if self.cropPolygon:
             painterPath = QPainterPath()
             painterPath.addPolygon(self.cropPolygon)
-            painter.setClipPath(painterPath)
-        painter.drawImage(QPoint(), self.Image)
+            painter.setClipPath(painterPath, Qt.IntersectClip)
         # draw polygon
         pen = QPen(self.PolygonEdgeColor, 5)
         painter.setPen(pen)
-        if len(self.polygonList):
-            for polygon in self.polygonList:
+        # only the polygons over the rect are drawn
+        polygons = self.polygonList if rect is None else self.polygonIndex.query(rect)
+        if len(polygons):
+            for polygon in polygons:
                 # pp = QPolygonF([QPointF(point[0], point[1]) for point in polygon['geo']])
                 if polygon['selected']:
                     painter.setBrush(self.PolygonSelectedColor)
                 else:
                     painter.setBrush(self.PolygonColor)
                 painter.drawPolygon(polygon['geo'])
-        painter.end()
-        if remove_useless_background and self.cropPolygon:
-            return paintedImage.copy(painterPath.boundingRect().toRect())
-        else:
-            return paintedImage
+        painter.restore()
@@ -12,20 +12,27 @@
 
 
 import datetime
+import os
+from uuid import uuid4
 
 import numpy as np
-import scipy.sparse as sp
 
-from PyQt5.QtCore import QPointF, QLineF, Qt, QUrl
+from PyQt5.QtCore import QPointF, QLineF, Qt, QUrl, QTimer
 from PyQt5.QtGui import QIcon, QPolygonF, QDesktopServices, QPixmap, QCloseEvent, QKeySequence
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QApplication, QAction, QLabel, QProgressBar, QFileDialog, \
     QMessageBox, QInputDialog, QMainWindow, QProgressDialog
 
 from ImageViewerWithLabel import ImageViewerWithLabel
 from ImageViewerWithPolygon import ImageViewerWithPolygon
+from ViewSync import ViewSyncController
+from ProjectThread import ProjectLoadThread, ProjectSaveThread
+from EditJournal import EditJournal, journalPath, readJournal, replayJournal
 import datetime
 import json
 
+# the edit journal is written in background every few seconds, ms
+JOURNAL_FLUSH_INTERVAL = 3000
+
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -220,13 +227,24 @@ class MainWindow(QMainWindow):
         self.originView.PolygonDrawFinishedSignal.connect(self.__updateActionState)
         self.originView.LineDrawFinishedSIgnal.connect(self.__updateActionState)
 
-        self.originView.ViewPointChangeSignal.connect(self.syncViewPoint)
-        self.resultView.ViewPointChangeSignal.connect(self.syncViewPoint)
+        # the view points of the two views are synchronized once in a display frame
+        self.viewSync = ViewSyncController([self.originView, self.resultView], parent=self)
+
+        # the edits after the project is saved are appended to the edit journal, for recovery after a crash
+        self.journal = None
+        self.originView.PolygonListUpdatedSignal.connect(self.__journalPolygon)
+        self.resultView.LabelMaskUpdatedSignal.connect(self.__journalLabels)
+        self.journalTimer = QTimer(self)
+        self.journalTimer.timeout.connect(lambda: self.journal.flush() if self.journal is not None else None)
+        self.journalTimer.start(JOURNAL_FLUSH_INTERVAL)
         self.initUi()
 
     def initUi(self):
+        self.__closeJournal()
         self.imagePath = None
         self.projectPath = None
+        # revision of the project file, the edit journal is replayed only on the same revision
+        self.revision = None
 
         self.realScale = None
 
@@ -254,30 +272,79 @@ class MainWindow(QMainWindow):
         if not filePath:
             QMessageBox.warning(self, 'No Project File Selected', 'No project file is selected.')
             return
+        self.initUi()
+        # the project archive, or the old JSON project, is loaded in background, the image and polygons are shown
+        # at first and the label image after them
+        records, end = self.__recoverJournal(filePath)
+        thread = ProjectLoadThread(filePath, journalRecords=records)
+        progress = self.__projectProgressDialog(thread, 'Opening Project', 'Loading project...')
+        thread.manifestSignal.connect(lambda project, image: self.__projectManifestLoaded(thread, project, image))
+        thread.arraysSignal.connect(self.__projectArraysLoaded)
+        thread.finishedSignal.connect(
+            lambda ok, message: self.__projectLoadFinished(progress, filePath, ok, message, end))
+        thread.start()
+
+    def __projectManifestLoaded(self, thread, project, image):
         try:
-            with open(filePath, 'r') as f:
-                project = json.load(f)
             # decode
-            self.initUi()
             project = JsonDecoding(project)
             self.imagePath = project['base_image']
-            self.originView.setImage(imagePath=self.imagePath)
+            self.revision = project.get('revision')
+            self.originView.setImage(imagePath=self.imagePath, image=image)
             self.originView.cropPolygon = project['crop_polygon']
-            self.originView.polygonList = project['polygon']
+            self.originView.setPolygonList(project['polygon'])
+            self.originView.invalidateFrame()
             self.originView.setViewPoint(scale=project['scale'], offset=project['offset'])
             if 'real_scale' in project:
                 self.realScale = project['real_scale']
 
-            self.resultView.setImage(imagePath=self.imagePath)
+            self.resultView.setImage(imagePath=self.imagePath, image=image)
             self.resultView.cropPolygon = project['crop_polygon']
+            self.resultView.invalidateFrame()
             self.resultView.setViewPoint(scale=project['scale'], offset=project['offset'])
-            self.resultView.addLabelMask(project['label_image'])
-            self.projectPath = filePath
             self.__updateActionState()
         except Exception as e:
+            thread.cancel()
+            thread.error = str(e)
+
+    def __projectArraysLoaded(self, arrays):
+        if self.resultView.Image is not None:
+            self.resultView.setLabelMask(arrays['label_image'])
+
+    def __projectLoadFinished(self, progress, filePath, ok, message, journalEnd=None):
+        progress.close()
+        message = message or getattr(self.projectThread, 'error', '')
+        if ok:
+            self.projectPath = filePath
+            # the recovered edits are kept in the journal until the project is saved
+            self.__startJournal(journalEnd if self.projectThread.recovered else None)
+        elif message:
+            print('Failed to open project: %s' % message)
+            self.initUi()
             QMessageBox.warning(self, 'Illegal Project Document',
                                 'Illegal project document, please select a legal one.')
-            return
+        else:
+            # the project isn't loaded completely, so it's not saved to the project file
+            QMessageBox.information(self, 'Canceled', 'Opening project is canceled, the label image is not loaded.')
+        self.__updateActionState()
+
+    def __projectProgressDialog(self, thread, title, label):
+        '''
+        progress dialog of the project thread, the thread is canceled by the cancel button.
+        '''
+        progress = QProgressDialog(self)
+        progress.setWindowTitle(title)
+        progress.setLabelText(label)
+        progress.setCancelButtonText("cancel")
+        progress.setMinimumDuration(0)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setRange(0, 100)
+        progress.canceled.connect(thread.cancel)
+        thread.progressSignal.connect(
+            lambda done, total: progress.setValue(int(done * 100 / total)) if total else None)
+        # the thread is kept until it's finished
+        self.projectThread = thread
+        return progress
 
     def saveProject(self):
         if self.projectPath is None:
@@ -306,6 +373,13 @@ class MainWindow(QMainWindow):
             self.imagePath = filePath
             self.originView.setImage(imagePath=filePath)
             self.resultView.setImage(imagePath=filePath)
+            # the edits of the new project are journaled beside the image until it's saved as a project
+            records, end = self.__recoverJournal(filePath)
+            if records and records[0][0].get('revision') is None and records[0][0].get('base_image') == filePath:
+                self.__applyRecoveredEdits(records)
+            else:
+                end = None
+            self.__startJournal(end)
         self.__updateActionState()
 
     def saveImageWithPolygon(self):
@@ -358,6 +432,8 @@ class MainWindow(QMainWindow):
                                     QMessageBox.Yes | QMessageBox.No,
                                     QMessageBox.No)
         if reply == QMessageBox.Yes:
+            # the unsaved edits are kept in the journal
+            self.__closeJournal()
             event.accept()
         else:
             event.ignore()
@@ -366,11 +442,6 @@ class MainWindow(QMainWindow):
     Edit Menu callback
     '''
 
-    def syncViewPoint(self, oldOffset, newOffset, oldScal, newScale):
-        self.originView.setViewPoint(newOffset, newScale)
-        self.resultView.setViewPoint(newOffset, newScale)
-        self.__updateActionState()
-
     def setRealScale(self):
         self.originView.startDraw(mode='scaleLine')
         global finished
@@ -391,6 +462,7 @@ class MainWindow(QMainWindow):
                 QMessageBox.warning('Length of line must be positive number.')
                 return
             self.realScale = lineLength / line.length()
+            self.__journalRecord('set', {'key': 'real_scale', 'value': self.realScale})
             finished = True
             print('Real Scale: %s' % self.realScale)
 
@@ -405,6 +477,7 @@ class MainWindow(QMainWindow):
             if mode != 'cropPolygon':
                 return
             # add polygon to originView and resultView
+            self.__journalRecord('set', {'key': 'crop_polygon', 'value': polygon})
             self.originView.setCropPolygon(polygon)
             self.resultView.setCropPolygon(polygon)
             self.__updateActionState()
@@ -434,11 +507,20 @@ class MainWindow(QMainWindow):
         progress.setMinimumDuration(5)
         progress.setWindowModality(Qt.WindowModal)
         progress.setRange(0, len(self.originView.polygonList))
-        for i, polygon in enumerate(self.originView.polygonList):
-            self.resultView.addPolygonArea(polygon['geo'])
-            progress.setValue(i + 1)
+        # ROIs are analysed in parallel, and merged as they complete
+        try:
+            finished = self.resultView.addPolygonAreas([polygon['geo'] for polygon in self.originView.polygonList],
+                                                       progress)
+        except Exception as e:
+            print('Failed to analyse ROIs: %s' % e)
+            QMessageBox.warning(self, 'Error', 'Analysis is failed, the finished ROIs are kept.')
+            self.__updateActionState()
+            return
         progress.close()
-        QMessageBox.information(self, 'Finished', 'Analysis is Finished.')
+        if finished:
+            QMessageBox.information(self, 'Finished', 'Analysis is Finished.')
+        else:
+            QMessageBox.information(self, 'Canceled', 'Analysis is canceled, the finished ROIs are kept.')
         self.__updateActionState()
 
     # 添加 riss 方法: Binary Images of Sheared Rock Joints: Characterization of Damaged Zones, doi: 10.1051/mmm:1996153
@@ -460,31 +542,27 @@ class MainWindow(QMainWindow):
         self.__updateActionState()
 
     def removeSmallBlocks(self):
-        if not self.realScale:
-            QMessageBox.warning(self, 'Error', 'The scale should be set before.')
-        # get the setting
-        minBlockSizeVlue, ok = QInputDialog.getDouble(self, 'Input the filter value(mm^2)',
-                                                      'Miniumn size of block(mm^2)', 1, 0)
-        if not ok:
-            return
-        self.resultView.removeSmallBlocks(minBlockSizeVlue / self.realScale / self.realScale)
-        self.__updateActionState()
+        self.__regionFilter(holes=False)
 
     def removeSmallHoles(self):
-        if not self.realScale:
-            QMessageBox.warning(self, 'Error', 'The scale should be set before.')
-        # get the setting
-        minHoleValue, ok = QInputDialog.getDouble(self, 'Input the filter value(mm^2)',
-                                                  'Miniumn size of hole in block(mm^2)', 1, 0)
-        if not ok:
-            return
-        self.resultView.removeSmallHoles(minHoleValue / self.realScale / self.realScale)
+        self.__regionFilter(holes=True)
+
+    def __regionFilter(self, holes):
+        from RegionFilterDialog import RegionFilterDialog
+        # preview with slider, the sizes of blocks (holes) are computed once
+        sizes = self.resultView.beginRegionFilter(holes)
+        dialog = RegionFilterDialog(sizes, self.realScale, holes, self)
+        dialog.thresholdChanged.connect(self.resultView.previewRegionFilter)
+        if dialog.exec_():
+            self.resultView.endRegionFilter(dialog.threshold())
+        else:
+            self.resultView.endRegionFilter()
         self.__updateActionState()
 
     def showResultTable(self):
         from ImageLabelDataTable import LabelDataTable
         self.resultTable = LabelDataTable()
-        self.resultTable.setData(self.resultView.labelMask, self.realScale, self.originView.cropPolygon)
+        self.resultTable.setData(self.resultView.regionStore, self.realScale, self.originView.cropPolygon)
         self.resultTable.show()
         self.__updateActionState()
         self.resultTable.labelSelectedSignal.connect(self.resultView.setShowLabelList)
@@ -535,12 +613,11 @@ class MainWindow(QMainWindow):
 
         # analysis
         self.analysisAction.setEnabled(len(self.originView.polygonList) > 0)
-        self.removeSmallBlocksAction.setEnabled(
-            type(self.resultView.labelMask) == np.ndarray and np.sum(
-                self.resultView.labelMask) > 0 and self.realScale > 0)
-        self.removeSmallHoleSAction.setEnabled(
-            type(self.resultView.labelMask) == np.ndarray and np.sum(self.resultView.labelMask) > 0 and self.realScale > 0)
-        self.showResultTableAction.setEnabled(type(self.resultView.labelMask) == np.ndarray and np.sum(self.resultView.labelMask) > 0)
+        # the label mask isn't scanned, the presence of labels is kept by the region store
+        hasLabels = self.resultView.hasLabels()
+        self.removeSmallBlocksAction.setEnabled(hasLabels and (self.realScale or 0) > 0)
+        self.removeSmallHoleSAction.setEnabled(hasLabels and (self.realScale or 0) > 0)
+        self.showResultTableAction.setEnabled(hasLabels)
         self.update()
 
     def aboutQt(self):
@@ -550,7 +627,9 @@ class MainWindow(QMainWindow):
         if not self.projectPath:
             QMessageBox.warning(self, 'Error', 'No project file selected.')
             return
-        project = {
+        # the project is saved in background, so it's a snapshot of the views: the manifest is encoded into
+        # JSON values and the label image is copied here, the edits during saving aren't written half-updated.
+        project = json.loads(json.dumps({
             'name': '',
             'base_image': self.imagePath,
             'crop_polygon': self.originView.cropPolygon,
@@ -558,16 +637,120 @@ class MainWindow(QMainWindow):
             'offset': self.originView.offset,
             'scale': self.originView.scale,
             'real_scale': self.realScale,
-            'label_image': self.resultView.labelMask
-        }
+            # the edit journal of the old revision isn't replayed on the new project file
+            'revision': str(uuid4())
+        }, cls=JsonEncoding))
+        project['label_image'] = self.resultView.labelMask.copy()
         filePath = self.projectPath
-        try:
-            with open(filePath, mode='w+', encoding='utf-8') as f:
-                json.dump(project, f, cls=JsonEncoding)
-                QMessageBox.information(self, 'Success', 'Project file has been created successfully.')
-        except Exception as e:
+        # the label image is saved as runs in the archive, the others in its JSON manifest. The progress dialog
+        # is shown at once and it's modal, so the project isn't changed while it's saved.
+        thread = ProjectSaveThread(filePath, project, encoder=JsonEncoding)
+        progress = self.__projectProgressDialog(thread, 'Saving Project', 'Saving project...')
+        thread.finishedSignal.connect(
+            lambda ok, message: self.__projectSaveFinished(progress, ok, message, project['revision']))
+        thread.start()
+
+    def __projectSaveFinished(self, progress, ok, message, revision):
+        progress.close()
+        if ok:
+            # the edits are saved in the project file, the journal is started again beside it
+            self.revision = revision
+            self.__closeJournal(remove=True)
+            self.__startJournal()
+            QMessageBox.information(self, 'Success', 'Project file has been created successfully.')
+        elif message:
+            print('Failed to write project file: %s' % message)
             QMessageBox.warning(self, 'Error', 'Failed to write project file.')
+        else:
+            QMessageBox.information(self, 'Canceled', 'Saving project is canceled, the project file is not changed.')
+
+
+    '''
+    edit journal
+    '''
+
+    def __startJournal(self, resume=None):
+        '''
+        start the edit journal beside the project file, or beside the image if the project isn't saved.
+        Args:
+            resume: int, end of the recovered records, they're kept in the journal. None to start a new journal
+
+        Returns:
+
+        '''
+        self.__closeJournal()
+        if not self.imagePath:
             return
+        begin = {
+            'revision': self.revision,
+            'base_image': self.imagePath,
+            'polygon_uids': [polygon['uid'] for polygon in self.originView.polygonList]
+        }
+        try:
+            self.journal = EditJournal(journalPath(self.projectPath or self.imagePath), begin, encoder=JsonEncoding,
+                                       resume=resume)
+        except Exception as e:
+            print('Failed to start edit journal: %s' % e)
+            self.journal = None
+
+    def __closeJournal(self, remove=False):
+        if self.journal is not None:
+            self.journal.close(remove=remove)
+            self.journal = None
+
+    def __journalRecord(self, action, data):
+        if self.journal is not None:
+            self.journal.record(action, data)
+
+    def __journalPolygon(self, action, polygon):
+        if action == 'add':
+            self.__journalRecord('polygon_add', {'polygon': polygon})
+        elif action == 'delete':
+            self.__journalRecord('polygon_delete', {'uid': polygon['uid']})
+
+    def __journalLabels(self, window, lut):
+        if self.journal is not None:
+            self.journal.recordLabels(self.resultView.labelMask, window, lut)
+
+    def __recoverJournal(self, path):
+        '''
+        read the edit journal beside the project file (or the image), and ask if the edits are recovered.
+        Args:
+            path: path of the project file or the image
+
+        Returns: (records, end) from readJournal, (None, None) if there is no edit or they're not recovered
+
+        '''
+        if not os.path.exists(journalPath(path)):
+            return None, None
+        try:
+            records, end = readJournal(journalPath(path))
+        except Exception as e:
+            print('Failed to read edit journal: %s' % e)
+            return None, None
+        if len(records) < 2:
+            return None, None
+        reply = QMessageBox.question(self, 'Recover',
+                                     'There are %d unsaved edits of the last session, recover them?\n'
+                                     'They are discarded if not.' % (len(records) - 1),
+                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+        if reply != QMessageBox.Yes:
+            return None, None
+        return records, end
+
+    def __applyRecoveredEdits(self, records):
+        '''
+        replay the recovered edits on the image without project.
+        '''
+        project = replayJournal({'crop_polygon': [], 'polygon': [], 'real_scale': None,
+                                 'label_image': np.array([])}, records)
+        project = JsonDecoding(project)
+        if project['crop_polygon']:
+            self.originView.setCropPolygon(project['crop_polygon'])
+            self.resultView.setCropPolygon(project['crop_polygon'])
+        self.originView.setPolygonList(project['polygon'])
+        self.realScale = project['real_scale']
+        self.resultView.setLabelMask(project['label_image'])
 
 
 class JsonEncoding(json.JSONEncoder):
@@ -582,13 +765,6 @@ class JsonEncoding(json.JSONEncoder):
                 obj.x(),
                 obj.y()
             ]
-        elif isinstance(obj, np.ndarray):
-            A = sp.csr_matrix(obj)
-            return {
-                'data': A.data.tolist(),
-                'indptr': A.indptr.tolist(),
-                'indices': A.indices.tolist()
-            }
         else:
             return super(JsonEncoding, self).default(obj)
 
@@ -607,14 +783,9 @@ def JsonDecoding(project):
             for point in polygon['geo']:
                 T.append(QPointF(point[0], point[1]))
             polygon['geo'] = T
-    # label_image
-    limage = project['label_image']
-    project['offset'] = QPointF(project['offset'][0], project['offset'][1])
-    if len(limage['data']):
-        project['label_image'] = sp.csr_matrix((limage['data'], limage['indices'], limage['indptr']),
-                                               dtype=int).toarray()
-    else:
-        project['label_image'] = np.array([])
+    # label_image is read as np.array by loadProject
+    if 'offset' in project:
+        project['offset'] = QPointF(project['offset'][0], project['offset'][1])
     return project
 
 
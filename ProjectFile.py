@@ -0,0 +1,265 @@
+#!/usr/bin/python3
+# -*-coding:utf-8 -*-
+
+# Reference: **********************************************
+# @Project   : code
+# @File    : ProjectFile.py
+# @Time    : 2026/10/18 21:30
+# @License   : LGPL
+# @Author   : Dorad
+# @Email    : cug.xia@gmail.com
+# @Blog      : https://blog.cuger.cn
+
+'''
+project file, a zip archive with a JSON manifest for the polygons and view point, and the arrays in .npy format with
+their own dtype. The label image is saved as its runs (values and lengths), so the size of the project is about the
+length of the region borders. The arrays are streamed into and out of the archive, no python list is made.
+The old JSON project files (label image in CSR lists) and the archives of version 2 (dense arrays) are still loaded.
+'''
+
+import json
+import os
+import stat
+import tempfile
+import zipfile
+
+import numpy as np
+
+from ImageAnalysis import compactLabels, encodeLabelRuns, decodeLabelRuns
+
+PROJECT_FORMAT = 'SDZM-Tool project'
+PROJECT_VERSION = 3
+# arrays saved as their runs
+RUN_LENGTH_ARRAYS = ('label_image',)
+MANIFEST_NAME = 'manifest.json'
+# the label image is mostly background, the fastest level compresses it well
+PROJECT_COMPRESS_LEVEL = 1
+# bytes of an array written or read at once, the progress is reported after each chunk
+ARRAY_CHUNK_BYTES = 16 * 1024 * 1024
+
+
+class ProjectCanceled(Exception):
+    '''
+    the project is not saved or loaded, the progress callback returned False.
+    '''
+    pass
+
+
+def saveProject(projectPath, project: dict, encoder=None, progress=None):
+    '''
+    write the project archive, the numpy arrays of project are saved as .npy (the label image as its runs), the
+    others in the manifest. The archive is written to a temporary file beside projectPath and renamed to it at last,
+    so the old project file is kept if it's failed or canceled.
+    Args:
+        projectPath: path of project file
+        project: dict, such as base_image, crop_polygon, polygon, offset, scale, real_scale and label_image
+        encoder: json.JSONEncoder class for the values in the manifest, such as Qt objects
+        progress: function (done, total) -> bool, bytes of the arrays written, it's canceled if False is returned
+
+    Returns:
+
+    '''
+    manifest = {'format': PROJECT_FORMAT, 'version': PROJECT_VERSION, 'arrays': {}}
+    # entry name -> array
+    entries = {}
+    for key, value in project.items():
+        if not isinstance(value, np.ndarray):
+            manifest[key] = value
+        elif key in RUN_LENGTH_ARRAYS and value.ndim == 2:
+            values, lengths = encodeLabelRuns(value)
+            manifest['arrays'][key] = {'encoding': 'runs', 'shape': list(value.shape),
+                                       'values': '%s.values.npy' % key, 'lengths': '%s.lengths.npy' % key}
+            entries[manifest['arrays'][key]['values']] = values
+            entries[manifest['arrays'][key]['lengths']] = lengths
+        else:
+            manifest['arrays'][key] = '%s.npy' % key
+            entries[manifest['arrays'][key]] = value
+    manifest = json.dumps(manifest, cls=encoder)
+    counter = ProgressCounter(sum(array.nbytes for array in entries.values()), progress)
+    directory, name = os.path.split(os.path.abspath(projectPath))
+    fd, tmpPath = tempfile.mkstemp(prefix='.%s.' % name, suffix='.tmp', dir=directory)
+    try:
+        with open(fd, 'wb') as file:
+            with zipfile.ZipFile(file, 'w', compression=zipfile.ZIP_DEFLATED,
+                                 compresslevel=PROJECT_COMPRESS_LEVEL) as archive:
+                archive.writestr(MANIFEST_NAME, manifest)
+                for name, array in entries.items():
+                    with archive.open(name, 'w', force_zip64=True) as f:
+                        writeArray(f, array, counter)
+            # the archive is on disk before it replaces the old project file
+            file.flush()
+            os.fsync(file.fileno())
+        # the temporary file is only readable by the owner, the project file keeps its mode
+        os.chmod(tmpPath, __fileMode(projectPath))
+        os.replace(tmpPath, projectPath)
+    except BaseException:
+        os.remove(tmpPath)
+        raise
+
+
+def loadProject(projectPath, arrays=True, progress=None):
+    '''
+    read the project file, the project archive or the old JSON project.
+    Args:
+        projectPath: path of project file
+        arrays: bool, read the arrays (label image), False to read only the manifest
+        progress: function (done, total) -> bool, bytes of the arrays read, it's canceled if False is returned
+
+    Returns: dict, the manifest with the arrays, label_image is a np.array in the narrowest dtype
+
+    '''
+    with ProjectReader(projectPath) as reader:
+        project = reader.manifest()
+        if arrays:
+            project.update(reader.arrays(progress))
+    return project
+
+
+class ProjectReader(object):
+    '''
+    reader of the project file in two stages, the manifest (image, polygons and view point) is read at first, and
+    the arrays (label image) are read after it, so the project could be shown before the label image is loaded.
+    '''
+
+    def __init__(self, projectPath):
+        self.archive = None
+        self.legacy = None
+        if zipfile.is_zipfile(projectPath):
+            self.archive = zipfile.ZipFile(projectPath, 'r')
+            self.project = json.loads(self.archive.read(MANIFEST_NAME).decode('utf-8'))
+            if self.project.get('format') != PROJECT_FORMAT:
+                raise Exception('Unknown project format: %s' % self.project.get('format'))
+            if self.project.get('version', 0) > PROJECT_VERSION:
+                raise Exception('Project version %s is not supported.' % self.project.get('version'))
+            self.names = self.project.pop('arrays', {})
+        else:
+            with open(projectPath, 'r') as f:
+                self.project = json.load(f)
+            # label image of the old JSON project, in CSR lists
+            self.legacy = self.project.pop('label_image', None)
+            self.names = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
+    def manifest(self):
+        '''
+        Returns: dict, the project without the arrays
+        '''
+        return dict(self.project)
+
+    def arrays(self, progress=None):
+        '''
+        read the arrays of the project.
+        Args:
+            progress: function (done, total) -> bool, bytes of the arrays read, it's canceled if False is returned
+
+        Returns: dict, key -> np.array
+
+        '''
+        if self.archive is None:
+            return {'label_image': legacyLabelImage(self.legacy)}
+        entries = []
+        for name in self.names.values():
+            entries += [name['values'], name['lengths']] if isinstance(name, dict) else [name]
+        counter = ProgressCounter(sum(self.archive.getinfo(name).file_size for name in entries), progress)
+        arrays = {}
+        for key, name in self.names.items():
+            if isinstance(name, dict):
+                # runs of the label image
+                arrays[key] = decodeLabelRuns(name['shape'], readArray(self.archive, name['values'], counter),
+                                              readArray(self.archive, name['lengths'], counter))
+            else:
+                arrays[key] = readArray(self.archive, name, counter)
+        return arrays
+
+
+class ProgressCounter(object):
+    '''
+    bytes done of the arrays, reported to the progress function.
+    '''
+
+    def __init__(self, total, progress=None):
+        self.total = total
+        self.done = 0
+        self.progress = progress
+
+    def add(self, count):
+        self.done += count
+        if self.progress is not None and self.progress(self.done, self.total) is False:
+            raise ProjectCanceled()
+
+
+def writeArray(f, array: np.array, counter: ProgressCounter = None):
+    '''
+    write the array in .npy format chunk by chunk.
+    '''
+    array = np.ascontiguousarray(array)
+    np.lib.format.write_array_header_1_0(f, np.lib.format.header_data_from_array_1_0(array))
+    data = array.reshape(-1).view(np.uint8)
+    for i in range(0, data.size, ARRAY_CHUNK_BYTES):
+        f.write(data[i:i + ARRAY_CHUNK_BYTES])
+        if counter is not None:
+            counter.add(min(ARRAY_CHUNK_BYTES, data.size - i))
+    if not data.size and counter is not None:
+        counter.add(0)
+
+
+def readArray(archive: zipfile.ZipFile, name, counter: ProgressCounter = None):
+    '''
+    read the array in .npy format from the archive chunk by chunk.
+    '''
+    with archive.open(name, 'r') as f:
+        version = np.lib.format.read_magic(f)
+        readHeader = np.lib.format.read_array_header_1_0 if version == (1, 0) else \
+            np.lib.format.read_array_header_2_0
+        shape, fortranOrder, dtype = readHeader(f)
+        if dtype.hasobject:
+            raise Exception('Illegal array in project: %s' % name)
+        array = np.empty(shape, dtype=dtype, order='F' if fortranOrder else 'C')
+        header = f.tell()
+        data = array.reshape(-1, order='A').view(np.uint8)
+        for i in range(0, data.size, ARRAY_CHUNK_BYTES):
+            count = f.readinto(data[i:i + ARRAY_CHUNK_BYTES])
+            if count != min(ARRAY_CHUNK_BYTES, data.size - i):
+                raise Exception('Truncated array in project: %s' % name)
+            if counter is not None:
+                counter.add(count + (header if i == 0 else 0))
+    return array
+
+
+def legacyLabelImage(labelImage):
+    '''
+    label image of the old JSON project, it's saved as the CSR lists (data, indices, indptr).
+    Args:
+        labelImage: dict, {data, indices, indptr}
+
+    Returns: np.array, label image in the narrowest dtype, empty if there is no label
+
+    '''
+    if not labelImage or not len(labelImage['data']):
+        return np.array([])
+    import scipy.sparse as sp
+    data = np.asarray(labelImage['data'], dtype=np.int64)
+    labelImage = sp.csr_matrix((data, np.asarray(labelImage['indices']), np.asarray(labelImage['indptr'])))
+    return compactLabels(labelImage.toarray(), int(data.max()))
+
+
+def __fileMode(path):
+    '''
+    permission bits of the file, or the default ones (0o666 without umask) of a new file if it doesn't exist.
+    '''
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
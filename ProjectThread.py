@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+# -*-coding:utf-8 -*-
+
+# Reference: **********************************************
+# @Project   : code
+# @File    : ProjectThread.py
+# @Time    : 2026/10/18 22:40
+# @License   : LGPL
+# @Author   : Dorad
+# @Email    : cug.xia@gmail.com
+# @Blog      : https://blog.cuger.cn
+
+from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtGui import QImage
+
+from EditJournal import LABEL_ACTIONS, PROJECT_ACTIONS, replayJournal
+from ProjectFile import ProjectCanceled, ProjectReader, saveProject
+
+
+class ProjectSaveThread(QThread):
+    '''
+    save the project in background, the project file is replaced only after it's written completely.
+    finishedSignal is emitted with (True, '') if it's saved, (False, '') if it's canceled, or (False, error).
+    '''
+    progressSignal = pyqtSignal([object, object], name='Project save progress')
+    finishedSignal = pyqtSignal([bool, str], name='Project save finished')
+
+    def __init__(self, projectPath, project: dict, encoder=None):
+        super(ProjectSaveThread, self).__init__()
+        self.projectPath = projectPath
+        self.project = project
+        self.encoder = encoder
+        self.canceled = False
+
+    def cancel(self):
+        self.canceled = True
+
+    def run(self):
+        try:
+            saveProject(self.projectPath, self.project, self.encoder, progress=self.__progress)
+            self.finishedSignal.emit(True, '')
+        except ProjectCanceled:
+            self.finishedSignal.emit(False, '')
+        except Exception as e:
+            self.finishedSignal.emit(False, str(e) or type(e).__name__)
+
+    def __progress(self, done, total):
+        self.progressSignal.emit(done, total)
+        return not self.canceled
+
+
+class ProjectLoadThread(QThread):
+    '''
+    load the project in background and in stages, manifestSignal is emitted with the manifest and the base image at
+    first, so the image and polygons could be shown, then arraysSignal is emitted with the label image.
+    finishedSignal is emitted with (True, '') if it's loaded, (False, '') if it's canceled, or (False, error).
+    The records of the edit journal are replayed on the project if they're based on it, and recovered is True.
+    '''
+    manifestSignal = pyqtSignal([object, object], name='Project manifest loaded')
+    arraysSignal = pyqtSignal([object], name='Project arrays loaded')
+    progressSignal = pyqtSignal([object, object], name='Project load progress')
+    finishedSignal = pyqtSignal([bool, str], name='Project load finished')
+
+    def __init__(self, projectPath, journalRecords=None):
+        super(ProjectLoadThread, self).__init__()
+        self.projectPath = projectPath
+        self.journalRecords = journalRecords
+        self.recovered = False
+        self.canceled = False
+
+    def cancel(self):
+        self.canceled = True
+
+    def run(self):
+        try:
+            with ProjectReader(self.projectPath) as reader:
+                project = reader.manifest()
+                # QImage could be loaded out of GUI thread
+                image = QImage(project['base_image'])
+                if image.isNull():
+                    raise Exception('Failed to load the image: %s' % project['base_image'])
+                if self.canceled:
+                    raise ProjectCanceled()
+                records = self.journalRecords
+                if records and (records[0][0].get('revision'), records[0][0].get('base_image')) != \
+                        (project.get('revision'), project['base_image']):
+                    print('The edit journal is not based on the project, it is ignored.')
+                    records = None
+                self.recovered = bool(records)
+                if records:
+                    replayJournal(project, records, actions=PROJECT_ACTIONS)
+                self.manifestSignal.emit(project, image)
+                arrays = reader.arrays(progress=self.__progress)
+            if records:
+                replayJournal(arrays, records, actions=LABEL_ACTIONS)
+            if self.canceled:
+                raise ProjectCanceled()
+            self.arraysSignal.emit(arrays)
+            self.finishedSignal.emit(True, '')
+        except ProjectCanceled:
+            self.finishedSignal.emit(False, '')
+        except Exception as e:
+            self.finishedSignal.emit(False, str(e) or type(e).__name__)
+
+    def __progress(self, done, total):
+        self.progressSignal.emit(done, total)
+        return not self.canceled
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# -*-coding:utf-8 -*-
+
+# Reference: **********************************************
+# @Project   : code
+# @File    : RegionFilterDialog.py
+# @Time    : 2026/10/18 17:10
+# @License   : LGPL
+# @Author   : Dorad
+# @Email    : cug.xia@gmail.com
+# @Blog      : https://blog.cuger.cn
+
+import sys
+
+import numpy as np
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtWidgets import QDialog, QApplication, QVBoxLayout, QHBoxLayout, QLabel, QSlider, QDoubleSpinBox, \
+    QDialogButtonBox
+
+
+class RegionFilterDialog(QDialog):
+    '''
+    slider of the minimum size for remove small blocks or fill small holes.
+    The slider steps through the sizes of the blocks (holes), so each step removes (fills) at least one more of them.
+    thresholdChanged is emitted with the threshold in pixels for the preview.
+    '''
+    thresholdChanged = pyqtSignal([float], name='Threshold changed')
+
+    def __init__(self, sizes, realScale=None, holes=False, parent=None):
+        super(RegionFilterDialog, self).__init__(parent)
+        # sorted sizes, the slider steps through the distinct sizes, and the last step removes all
+        self.sizes = np.sort(np.asarray(sizes))
+        self.steps = np.append(np.unique(self.sizes), self.sizes[-1] + 1 if self.sizes.size else 1)
+        # mm^2 per pixel, or pixel if there is no scale
+        self.areaScale = realScale * realScale if realScale else 1.
+        self.unit = 'mm^2' if realScale else 'px^2'
+        self.holes = holes
+        self.initUi()
+        self.setThreshold(0)
+
+    def initUi(self):
+        self.setWindowTitle('Fill Small Holes' if self.holes else 'Remove Small Blocks')
+        self.slider = QSlider(Qt.Horizontal)
+        self.slider.setRange(0, self.steps.size - 1)
+        self.slider.valueChanged.connect(self.sliderChangedAction)
+        self.valueBox = QDoubleSpinBox()
+        self.valueBox.setDecimals(4)
+        self.valueBox.setRange(0, float(self.steps[-1]) * self.areaScale)
+        self.valueBox.setSuffix(' ' + self.unit)
+        self.valueBox.valueChanged.connect(self.valueChangedAction)
+        self.infoLabel = QLabel()
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+
+        hBox = QHBoxLayout()
+        hBox.addWidget(QLabel('Miniumn size of %s:' % ('hole in block' if self.holes else 'block')))
+        hBox.addWidget(self.slider, 1)
+        hBox.addWidget(self.valueBox)
+        mainLayout = QVBoxLayout()
+        mainLayout.addLayout(hBox)
+        mainLayout.addWidget(self.infoLabel)
+        mainLayout.addWidget(buttons)
+        self.setLayout(mainLayout)
+        self.resize(480, self.sizeHint().height())
+
+    def threshold(self):
+        '''
+        the blocks (holes) smaller than threshold are removed (filled).
+        Returns: float, pixels
+
+        '''
+        return self.thresholdValue
+
+    def setThreshold(self, threshold):
+        self.thresholdValue = float(threshold)
+        count = int(np.searchsorted(self.sizes, self.thresholdValue, side='left'))
+        self.infoLabel.setText('%d of %d %s will be %s, %.2f %s.' % (
+            count, self.sizes.size, 'holes' if self.holes else 'blocks', 'filled' if self.holes else 'removed',
+            np.sum(self.sizes[:count]) * self.areaScale, self.unit))
+        self.thresholdChanged.emit(self.thresholdValue)
+
+    def sliderChangedAction(self, value):
+        threshold = self.steps[value]
+        self.valueBox.blockSignals(True)
+        self.valueBox.setValue(threshold * self.areaScale)
+        self.valueBox.blockSignals(False)
+        self.setThreshold(threshold)
+
+    def valueChangedAction(self, value):
+        threshold = value / self.areaScale
+        self.slider.blockSignals(True)
+        self.slider.setValue(int(np.searchsorted(self.steps, threshold, side='left')))
+        self.slider.blockSignals(False)
+        self.setThreshold(threshold)
+
+
+if __name__ == '__main__':
+    app = QApplication(sys.argv)
+    demo = RegionFilterDialog(np.random.randint(1, 1000, 500), 0.1)
+    demo.thresholdChanged.connect(lambda threshold: print('threshold: %.2f px' % threshold))
+    demo.show()
+    sys.exit(app.exec_())
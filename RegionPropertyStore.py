@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+# -*-coding:utf-8 -*-
+
+# Reference: **********************************************
+# @Project   : code
+# @File    : RegionPropertyStore.py
+# @Time    : 2026/10/18 15:40
+# @License   : LGPL
+# @Author   : Dorad
+# @Email    : cug.xia@gmail.com
+# @Blog      : https://blog.cuger.cn
+
+import numpy as np
+
+from ImageAnalysis import REGION_PROPERTIES, REGION_CHUNK_ROWS, regionStatistics, regionPixels
+
+
+class RegionPropertyStore(object):
+    '''
+    properties of the regions in a label image, kept in columns indexed by label id.
+    The properties are computed once for each version of the label image, after an edit only the labels touched by
+    the edit are computed again. The viewer, result table and exporters read the properties from here.
+    '''
+
+    def __init__(self, labelMask: np.array = None):
+        self.labelMask = None
+        self.version = 0
+        # present[i] is True if label i has pixels
+        self.present = np.zeros(1, dtype=bool)
+        self.columns = {key: np.zeros(1) for key in REGION_PROPERTIES[1:]}
+        # bounding box of each label, (min_row, min_col, max_row, max_col), max is exclusive
+        self.bbox = np.zeros([1, 4], dtype=np.int64)
+        if labelMask is not None:
+            self.setLabelMask(labelMask)
+
+    def setLabelMask(self, labelMask: np.array):
+        '''
+        set a new label image, the properties of all labels are computed.
+        Args:
+            labelMask: np.array, (H, W), label image
+
+        Returns:
+
+        '''
+        self.labelMask = labelMask
+        self.version += 1
+        self.__resize(1, reset=True)
+        if labelMask.size:
+            self.__compute(None, (0, labelMask.shape[0], 0, labelMask.shape[1]))
+
+    def update(self, labelMask: np.array = None, window=None, lut=None):
+        '''
+        update the properties after the label image is edited, all the labels are computed if neither window nor lut
+        is given.
+        Args:
+            labelMask: np.array, the edited label image, default the label image edited in place
+            window: (r0, r1, c0, c1), the pixels are only changed inside the window, optional
+            lut: np.array, old label id to new label id, if the label ids are remapped, 0 for the removed labels
+
+        Returns:
+
+        '''
+        if labelMask is None:
+            labelMask = self.labelMask
+        if window is None and lut is None:
+            self.setLabelMask(labelMask)
+            return
+        self.labelMask = labelMask
+        self.version += 1
+        touched = []
+        if lut is not None:
+            # labels united by the lut are computed again
+            touched.append(self.__remap(np.asarray(lut, dtype=np.int64)))
+        if window is not None:
+            r0, r1, c0, c1 = window
+            r0, c0 = max(0, r0), max(0, c0)
+            r1, c1 = min(labelMask.shape[0], r1), min(labelMask.shape[1], c1)
+            if r0 >= r1 or c0 >= c1:
+                window = None
+            else:
+                window = (r0, r1, c0, c1)
+                ids = np.flatnonzero(self.present)
+                box = self.bbox[ids]
+                # labels which lost pixels in the window and labels which are in the window
+                touched.append(ids[(box[:, 0] < r1) & (box[:, 2] > r0) & (box[:, 1] < c1) & (box[:, 3] > c0)])
+                touched.append(np.unique(labelMask[r0:r1, c0:c1]))
+        touched = np.unique(np.concatenate(touched)) if touched else np.zeros(0, dtype=np.int64)
+        touched = touched[touched > 0]
+        if touched.size:
+            self.__compute(touched, window)
+
+    def relabel(self, labelMask: np.array):
+        '''
+        replace the label image with a relabeled one, such as the result of remove small blocks or holes.
+        The lut from old label id to new label id is found from the two images, only the labels which are united,
+        split or changed are computed again.
+        Args:
+            labelMask: np.array, new label image, the old label image should not be changed
+
+        Returns:
+
+        '''
+        old = self.labelMask
+        if old is None or old.shape != labelMask.shape:
+            self.setLabelMask(labelMask)
+            return
+        lut = np.zeros(max(self.present.size, int(old.max(initial=0)) + 1), dtype=np.int64)
+        lut[old.ravel()] = labelMask.ravel()
+        lut[0] = 0
+        # pixels not following the lut, they are the split labels and the pixels added or removed
+        changed = lut[old] != labelMask
+        window = None
+        if changed.any():
+            rows, cols = np.flatnonzero(changed.any(axis=1)), np.flatnonzero(changed.any(axis=0))
+            window = (rows[0], rows[-1] + 1, cols[0], cols[-1] + 1)
+        self.update(labelMask, window=window, lut=lut)
+
+    def labels(self):
+        '''
+        ids of the labels with pixels, in ascending order.
+        '''
+        return np.flatnonzero(self.present)
+
+    def statistics(self):
+        '''
+        properties of all the regions, the same as ImageAnalysis.regionStatistics.
+        Returns: dict of np.array, keys in REGION_PROPERTIES, one item for each region
+
+        '''
+        ids = self.labels()
+        stats = {'label': ids}
+        for key in REGION_PROPERTIES[1:]:
+            stats[key] = self.columns[key][ids]
+        return stats
+
+    def __resize(self, size, reset=False):
+        if reset:
+            self.present = np.zeros(size, dtype=bool)
+            self.columns = {key: np.zeros(size) for key in REGION_PROPERTIES[1:]}
+            self.bbox = np.zeros([size, 4], dtype=np.int64)
+        elif size > self.present.size:
+            grow = size - self.present.size
+            self.present = np.concatenate([self.present, np.zeros(grow, dtype=bool)])
+            for key in self.columns:
+                self.columns[key] = np.concatenate([self.columns[key], np.zeros(grow)])
+            self.bbox = np.concatenate([self.bbox, np.zeros([grow, 4], dtype=np.int64)])
+
+    def __remap(self, lut):
+        '''
+        move the properties to the new label ids, the bounding boxes of united labels are merged.
+        Args:
+            lut: np.array, old label id to new label id
+
+        Returns: np.array, ids of the united labels
+
+        '''
+        ids = np.flatnonzero(self.present)
+        ids = ids[ids < lut.size]
+        targets = lut[ids]
+        keep = targets > 0
+        ids, targets = ids[keep], targets[keep]
+        columns, bbox = self.columns, self.bbox
+        self.__resize(int(lut.max(initial=0)) + 1, reset=True)
+        single = np.bincount(targets, minlength=self.present.size)[targets] == 1
+        self.present[targets[single]] = True
+        for key in columns:
+            self.columns[key][targets[single]] = columns[key][ids[single]]
+        self.bbox[:, :2] = np.iinfo(np.int64).max
+        np.minimum.at(self.bbox[:, 0], targets, bbox[ids, 0])
+        np.minimum.at(self.bbox[:, 1], targets, bbox[ids, 1])
+        np.maximum.at(self.bbox[:, 2], targets, bbox[ids, 2])
+        np.maximum.at(self.bbox[:, 3], targets, bbox[ids, 3])
+        self.bbox[~np.isin(np.arange(self.present.size), targets)] = 0
+        return np.unique(targets[~single])
+
+    def __compute(self, labels, window):
+        '''
+        compute the properties of labels inside the union of their bounding boxes and the window.
+        Args:
+            labels: np.array, label ids, None for all the labels
+            window: (r0, r1, c0, c1), optional
+
+        Returns:
+
+        '''
+        boxes = [] if window is None else [window]
+        if labels is not None:
+            # labels with bounding box, including the united labels
+            known = labels[labels < self.present.size]
+            known = known[self.bbox[known, 2] > self.bbox[known, 0]]
+            boxes += [(b[0], b[2], b[1], b[3]) for b in self.bbox[known]]
+        if not boxes:
+            return
+        boxes = np.array(boxes)
+        r0, r1 = boxes[:, 0].min(), boxes[:, 1].max()
+        c0, c1 = boxes[:, 2].min(), boxes[:, 3].max()
+        sub = self.labelMask[r0:r1, c0:c1]
+        maxLabel = int(sub.max(initial=0))
+        if labels is not None:
+            # only the touched labels are kept
+            self.__resize(int(labels.max()) + 1)
+            self.present[labels] = False
+            self.bbox[labels] = 0
+            # the lut keeps the dtype of the label image, the touched labels fit into it
+            lut = np.zeros(maxLabel + 1, dtype=sub.dtype)
+            lut[labels[labels <= maxLabel]] = labels[labels <= maxLabel]
+            sub = lut[sub]
+        self.__resize(maxLabel + 1)
+        stats = regionStatistics(sub)
+        ids = stats['label']
+        if not ids.size:
+            return
+        self.present[ids] = True
+        for key in self.columns:
+            self.columns[key][ids] = stats[key]
+        self.columns['centroid_row'][ids] += r0
+        self.columns['centroid_col'][ids] += c0
+        self.bbox[ids] = RegionPropertyStore.__boundingBoxes(sub, maxLabel + 1)[ids] + [r0, c0, r0, c0]
+
+    @staticmethod
+    def __boundingBoxes(labelMask, size):
+        '''
+        bounding boxes of the labels, the rows are reduced chunk by chunk in the dtype of the label image.
+        Args:
+            labelMask: np.array, label image
+            size: int, max label id + 1
+
+        Returns: np.array, (size, 4), (min_row, min_col, max_row, max_col), max is exclusive
+
+        '''
+        bbox = np.zeros([size, 4], dtype=np.int64)
+        bbox[:, :2] = np.iinfo(np.int64).max
+        for r0 in range(0, labelMask.shape[0], REGION_CHUNK_ROWS):
+            labels, rows, cols = regionPixels(labelMask[r0:r0 + REGION_CHUNK_ROWS], r0)
+            np.minimum.at(bbox[:, 0], labels, rows)
+            np.minimum.at(bbox[:, 1], labels, cols)
+            np.maximum.at(bbox[:, 2], labels, rows + 1)
+            np.maximum.at(bbox[:, 3], labels, cols + 1)
+        return bbox
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+# -*-coding:utf-8 -*-
+
+# Reference: **********************************************
+# @Project   : code
+# @File    : SpatialIndex.py
+# @Time    : 2026/10/18 20:40
+# @License   : LGPL
+# @Author   : Dorad
+# @Email    : cug.xia@gmail.com
+# @Blog      : https://blog.cuger.cn
+
+import math
+
+from PyQt5.QtCore import QRectF
+
+# size of the grid cells in pixels of the image
+SPATIAL_INDEX_CELL = 256
+
+
+class SpatialIndex(object):
+    '''
+    uniform grid over the bounding boxes of items, such as the ROI polygons.
+    Each item is kept in the cells its bounding box covers, so a query only checks the items near the rect.
+    The items are returned in the order they're inserted, which is the order they're drawn.
+    '''
+
+    def __init__(self, cellSize=SPATIAL_INDEX_CELL):
+        self.cellSize = cellSize
+        self.clear()
+
+    def clear(self):
+        # key -> (order, (x0, y0, x1, y1), item)
+        self.items = {}
+        # (cx, cy) -> set of keys
+        self.cells = {}
+        self.count = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def insert(self, key, rect: QRectF, item=None):
+        '''
+        insert an item, it's replaced if the key exists.
+        Args:
+            key: hashable, such as uid of the polygon
+            rect: QRectF, bounding box of the item
+            item: object returned by the queries, default the key
+
+        Returns:
+
+        '''
+        if key in self.items:
+            self.remove(key)
+        box = (rect.left(), rect.top(), rect.right(), rect.bottom())
+        self.items[key] = (self.count, box, key if item is None else item)
+        self.count += 1
+        for cell in self.__cells(box):
+            self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        if key not in self.items:
+            return
+        for cell in self.__cells(self.items.pop(key)[1]):
+            keys = self.cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self.cells[cell]
+
+    def get(self, key):
+        return self.items[key][2] if key in self.items else None
+
+    def query(self, rect: QRectF):
+        '''
+        items whose bounding box intersects the rect, the edges are included.
+        Args:
+            rect: QRectF, it may be empty for a point
+
+        Returns: list, items in the order they're inserted
+
+        '''
+        x0, y0, x1, y1 = rect.left(), rect.top(), rect.right(), rect.bottom()
+        keys = set()
+        for cell in self.__cells((x0, y0, x1, y1)):
+            keys.update(self.cells.get(cell, ()))
+        found = []
+        for key in keys:
+            order, box, item = self.items[key]
+            if box[0] <= x1 and box[2] >= x0 and box[1] <= y1 and box[3] >= y0:
+                found.append((order, item))
+        found.sort(key=lambda x: x[0])
+        return [item for order, item in found]
+
+    def queryPoint(self, x, y):
+        return self.query(QRectF(x, y, 0, 0))
+
+    def __cells(self, box):
+        cx0, cy0 = int(math.floor(box[0] / self.cellSize)), int(math.floor(box[1] / self.cellSize))
+        cx1, cy1 = int(math.floor(box[2] / self.cellSize)), int(math.floor(box[3] / self.cellSize))
+        return [(cx, cy) for cy in range(cy0, cy1 + 1) for cx in range(cx0, cx1 + 1)]
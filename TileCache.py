@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+# -*-coding:utf-8 -*-
+
+# Reference: **********************************************
+# @Project   : code
+# @File    : TileCache.py
+# @Time    : 2026/10/18 19:20
+# @License   : LGPL
+# @Author   : Dorad
+# @Email    : cug.xia@gmail.com
+# @Blog      : https://blog.cuger.cn
+
+from collections import OrderedDict
+
+from PyQt5.QtGui import QImage
+
+# size of the tiles in pixels of their pyramid level
+TILE_SIZE = 256
+# tiles kept in the cache, 64 MB of ARGB32 tiles
+TILE_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class TileCache(object):
+    '''
+    least recently used cache of the rendered tiles, keyed by (layer, level, tx, ty).
+    The least recently used tiles are dropped when the tiles are larger than capacity bytes.
+    '''
+
+    def __init__(self, capacity=TILE_CACHE_BYTES):
+        self.capacity = capacity
+        self.tiles = OrderedDict()
+        self.bytes = 0
+
+    def get(self, key):
+        '''
+        tile of the key, it's moved to the most recently used.
+        Args:
+            key: (layer, level, tx, ty)
+
+        Returns: QImage, None if it's not cached
+
+        '''
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+        return tile
+
+    def put(self, key, tile: QImage):
+        if key in self.tiles:
+            self.bytes -= self.tiles.pop(key).sizeInBytes()
+        self.tiles[key] = tile
+        self.bytes += tile.sizeInBytes()
+        while self.bytes > self.capacity and len(self.tiles) > 1:
+            self.bytes -= self.tiles.popitem(last=False)[1].sizeInBytes()
+
+    def invalidate(self, layer=None, level=None, tiles=None):
+        '''
+        drop the tiles matched by all the given arguments, all the tiles if no argument is given.
+        Args:
+            layer: str, layer of the tiles
+            level: int, the tiles of this level and the coarser levels
+            tiles: function (level) -> (tx0, ty0, tx1, ty1), range of the tiles in each level, max is exclusive
+
+        Returns:
+
+        '''
+        for key in list(self.tiles.keys()):
+            if layer is not None and key[0] != layer:
+                continue
+            if level is not None and key[1] < level:
+                continue
+            if tiles is not None:
+                tx0, ty0, tx1, ty1 = tiles(key[1])
+                if not (tx0 <= key[2] < tx1 and ty0 <= key[3] < ty1):
+                    continue
+            self.bytes -= self.tiles.pop(key).sizeInBytes()
+
+    def clear(self):
+        self.tiles.clear()
+        self.bytes = 0
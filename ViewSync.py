@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+# -*-coding:utf-8 -*-
+
+# Reference: **********************************************
+# @Project   : code
+# @File    : ViewSync.py
+# @Time    : 2026/10/18 20:10
+# @License   : LGPL
+# @Author   : Dorad
+# @Email    : cug.xia@gmail.com
+# @Blog      : https://blog.cuger.cn
+
+from PyQt5.QtCore import QObject, QTimer, QPointF
+
+# ms, the view points are synchronized at most once in a display frame
+VIEW_SYNC_INTERVAL = 16
+
+
+class ViewSyncController(QObject):
+    '''
+    keep the view points of the image viewers the same.
+    The changes of the view point in a display frame are coalesced, only the last one is applied to the other views,
+    and their signals are blocked while it's applied, so the views don't synchronize each other again.
+    '''
+
+    def __init__(self, views=(), interval=VIEW_SYNC_INTERVAL, parent=None):
+        super(ViewSyncController, self).__init__(parent)
+        self.views = []
+        # (source view, offset, scale) of the last change not applied yet
+        self.pending = None
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+        for view in views:
+            self.addView(view)
+
+    def addView(self, view):
+        self.views.append(view)
+        view.ViewPointChangeSignal.connect(
+            lambda oldOffset, newOffset, oldScale, newScale, view=view: self.viewPointChangedAction(view, newOffset,
+                                                                                                    newScale))
+
+    def viewPointChangedAction(self, source, offset: QPointF, scale):
+        self.pending = (source, QPointF(offset), scale)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        '''
+        apply the last change of the view point to the other views.
+        '''
+        if self.pending is None:
+            return
+        source, offset, scale = self.pending
+        self.pending = None
+        for view in self.views:
+            if view is source:
+                continue
+            blocked = view.blockSignals(True)
+            view.setViewPoint(offset=offset, scale=scale)
+            view.blockSignals(blocked)